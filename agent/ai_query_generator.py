@@ -5,18 +5,82 @@ and discovered database schema. It logs each query to a file and places them as
 """
 
 from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
 import re
-import psycopg2
+import shutil
 import logging
-from typing import Dict, List
+from typing import List, Tuple
 
-from utils.global_utils import extract_fenced_code, current_timestamp
+from utils.global_utils import current_timestamp
 from queue_manager.query_message import QueryMessage
 from queue_manager.shared_queue import SharedQueue
-from agent.base_ai_agent import BaseAIAgent
+from agent.base_ai_agent import (
+    BaseAIAgent, Schema, close_pool, fetch_schema_rows, fetch_schema_version, pooled_connection,
+    schema_from_rows,
+)
+
+try:
+    # RE2 matches in linear time, so long or adversarial LLM output cannot trigger backtracking.
+    import re2 as _regex_engine
+except ImportError:  # google-re2 is optional; the stdlib engine handles typical replies fine.
+    _regex_engine = re
 
 logger = logging.getLogger(__name__)
 
+# Output token budget per requested query; scaled by the batch size so that a
+# multi-query response is not truncated.
+MAX_OUTPUT_TOKENS_PER_QUERY = 1500
+
+# All generated queries of a run are appended to this file inside logs_dir.
+QUERY_LOG_FILENAME = "queries.sql"
+
+NO_COMMENT = "No purpose comment provided by LLM"
+
+# Reply the LLM gives, outside any code block, when it has no further queries to offer.
+DONE_TOKEN = "DONE"
+# DONE_TOKEN as the whole text after the last fence, once the character after it has arrived.
+_DONE_RE = re.compile(rf"\s*{DONE_TOKEN}(?=\W)")
+
+# Matches one fenced SQL block; an optional leading "-- Purpose: ..." line is captured as the comment.
+# Flags are inline so the pattern compiles unchanged under either regex engine.
+_SQL_BLOCK_RE = _regex_engine.compile(
+    r"(?is)```sql\s*\n(?:--\s*(?:Purpose:\s*)?(?P<comment>[^\n]*)\n)?(?P<body>.*?)```"
+)
+
+
+def _read_stream_until_done(stream) -> str:
+    """
+    Accumulates the output text of a streamed response.
+
+    Reading stops, and the stream is closed, as soon as the text after the last fenced code
+    block starts with DONE_TOKEN as a whole word, so an early "DONE" does not wait for the rest
+    of the generation. The token inside prose, such as in "ABANDONED", does not count.
+
+    :param stream: An iterable of response stream events.
+    :return: The text received so far.
+    """
+    parts = []
+    in_fence = False
+    tail = ""  # Text since the last fence marker; a marker or DONE may span deltas.
+    for event in stream:
+        if event.type != "response.output_text.delta":
+            continue
+        parts.append(event.delta)
+        tail += event.delta
+        fence = tail.find("```")
+        while fence >= 0:
+            in_fence = not in_fence
+            tail = tail[fence + 3:]
+            fence = tail.find("```")
+        if not in_fence and _DONE_RE.match(tail):
+            logger.debug("LLM signalled %s; closing response stream early.", DONE_TOKEN)
+            stream.close()
+            break
+    return "".join(parts)
+
 
 class AIQueryGenerator(BaseAIAgent):
     """
@@ -31,82 +95,104 @@ class AIQueryGenerator(BaseAIAgent):
         logs_dir: str = "logs/sql",
         model_name: str = "gpt-3.5-turbo",
         temperature: float = 0.7,
+        schema_cache_dir: str = "logs/.schema_cache",
     ):
         # Initialize common AI client functionality.
         super().__init__(model_name, temperature)
         self.connection_string = connection_string
         self.shared_queue = shared_queue
-        # Initialize logs_dir as a Path object and ensure it exists.
+        # Start from an empty logs_dir; removing the whole tree avoids a Python-level
+        # stat/unlink per file left behind by earlier runs.
         self.logs_dir = Path(logs_dir)
+        shutil.rmtree(self.logs_dir, ignore_errors=True)
         self.logs_dir.mkdir(parents=True, exist_ok=True)
-        # Clean up existing query files in logs_dir
-        for file in self.logs_dir.glob("query_*.sql"):
-            file.unlink()
         self.model_name = model_name
         self.temperature = temperature
+        self.schema_cache_dir = Path(schema_cache_dir)
+        self.schema_cache_dir.mkdir(parents=True, exist_ok=True)
 
         try:
-            self.conn = psycopg2.connect(self.connection_string)
-            self.conn.autocommit = True
-            logger.info("Connected to database successfully.")
+            with pooled_connection(self.connection_string):
+                logger.info("Connected to database successfully.")
         except Exception as e:
             logger.error("Database connection failed: %s", e)
             raise
 
-        self.schema_dict = self._discover_schema()
-        self.schema_text = self._format_schema_for_prompt(self.schema_dict)
+        self.schema = self._load_schema()
+        self.schema_text = self._format_schema_for_prompt(self.schema)
+        # One append handle for the whole run; writes collect in its buffer until
+        # _flush_query_log() or close().
+        self._log_fp = open(self.logs_dir / QUERY_LOG_FILENAME, "a", encoding="utf-8", buffering=1 << 16)
 
-    def _discover_schema(self) -> Dict[str, List[str]]:
+    def _schema_version(self) -> str:
         """
-        Discovers the database schema by querying the INFORMATION_SCHEMA.
+        Returns a token that changes whenever tables or columns are changed.
+        """
+        with pooled_connection(self.connection_string) as conn:
+            return fetch_schema_version(conn)
 
-        :return: A dictionary mapping full table names to lists of columns.
+    def _load_schema(self) -> Schema:
         """
-        schema_dict = {}
-        query = """
-            SELECT table_schema, table_name, column_name
-            FROM information_schema.columns
-            WHERE table_schema NOT IN ('information_schema', 'pg_catalog')
-            ORDER BY table_schema, table_name, ordinal_position
+        Returns the database schema, reusing the on-disk cache when its version token still matches.
+
+        The cache is keyed by the connection string, so restarts of the generator process
+        skip the INFORMATION_SCHEMA scan unless the catalog has changed.
+
+        :return: A list of (full table name, columns) pairs.
         """
-        with self.conn.cursor() as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-        for (schema, table, column) in rows:
-            full_name = f"{schema}.{table}"
-            schema_dict.setdefault(full_name, []).append(column)
-        logger.info("Discovered schema with %d tables.", len(schema_dict))
-        return schema_dict
+        key = hashlib.sha1(self.connection_string.encode("utf-8")).hexdigest()
+        cache_file = self.schema_cache_dir / f"{key}.json"
+        version = self._schema_version()
+        try:
+            cached = json.loads(cache_file.read_text(encoding="utf-8"))
+            if cached["version"] == version:
+                logger.info("Loaded schema with %d tables from cache.", len(cached["schema"]))
+                return [(table, cols) for table, cols in cached["schema"]]
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug("Schema cache unavailable: %s", e)
+        schema = self._discover_schema()
+        # Write to a private temp file and rename so concurrent readers never see a partial file.
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps({"version": version, "schema": schema}), encoding="utf-8")
+        os.replace(tmp_file, cache_file)
+        return schema
 
-    def _format_schema_for_prompt(self, schema_dict: Dict[str, List[str]]) -> str:
+    def _discover_schema(self) -> Schema:
         """
-        Formats the schema dictionary into a string for the LLM prompt.
+        Discovers the database schema by querying the INFORMATION_SCHEMA.
 
-        :param schema_dict: The schema dictionary.
-        :return: A string representation of the schema.
+        :return: A list of (full table name, columns) pairs.
         """
-        lines = []
-        for table, cols in schema_dict.items():
-            lines.append(f"Table: {table}\n  Columns: {', '.join(cols)}\n")
-        return "\n".join(lines)
+        with pooled_connection(self.connection_string) as conn:
+            rows = fetch_schema_rows(conn)
+        schema = schema_from_rows(rows)
+        logger.info("Discovered schema with %d tables.", len(schema))
+        return schema
 
-    def generate_response(self, input_data: List[dict]) -> str:
+    def generate_response(
+        self, input_data: List[dict], max_output_tokens: int = MAX_OUTPUT_TOKENS_PER_QUERY
+    ) -> str:
         """
         Implements the abstract method from BaseAIAgent.
         Here, input_data is expected to be a list of messages.
+        The response is streamed so that a "DONE" reply ends the request early.
         """
-        response = self.client.responses.create(
+        stream = self.client.responses.create(
             model=self.model_name,
             input=input_data,
             temperature=self.temperature,
-            max_output_tokens=1500
+            max_output_tokens=max_output_tokens,
+            stream=True,
         )
-        logger.debug(f"openai response: {response.output[0].content[0].text}")
-        return response.output[0].content[0].text.strip()
+        text = _read_stream_until_done(stream)
+        logger.debug("openai response: %s", text)
+        return text.strip()
 
-    def _generate_llm_message(self, messages: List[dict]) -> str:
+    def _generate_llm_message(
+        self, messages: List[dict], max_output_tokens: int = MAX_OUTPUT_TOKENS_PER_QUERY
+    ) -> str:
         # Delegate to the common generate_response method.
-        return self.generate_response(messages)
+        return self.generate_response(messages, max_output_tokens=max_output_tokens)
 
     def _extract_sql_query_and_comment(self, llm_output: str):
         """
@@ -122,49 +208,121 @@ class AIQueryGenerator(BaseAIAgent):
         :return: A tuple (query, comment).
         """
         logger.debug("Extracting SQL query and comment from LLM output: %s", llm_output)
-        # If no fenced code block is in the output, treat it as no SQL.
-        if "```" not in llm_output:
-            logger.debug("No code fence found in LLM output.")
-            return "", "No purpose comment provided by LLM"
-        text = extract_fenced_code(llm_output, language="sql")
-        if not text.strip():
-            logger.debug("Fenced code is empty.")
-            return "", "No purpose comment provided by LLM"
-        lines = text.splitlines()
-        comment = None
-        query_lines = []
-        for line in lines:
-            if line.strip().startswith("--") and comment is None:
-                comment = line.strip().lstrip("-").strip()
-                # Strip "Purpose: " prefix if present
-                if comment.lower().startswith("purpose:"):
-                    comment = comment[len("purpose:"):].strip()
-            else:
-                query_lines.append(line)
-        if not comment:
-            comment = "No purpose comment provided by LLM"
-        query = "\n".join(query_lines).strip()
+        match = _SQL_BLOCK_RE.search(llm_output)
+        if not match:
+            logger.debug("No fenced SQL block found in LLM output.")
+            return "", NO_COMMENT
+        return self._block_query_and_comment(match)
+
+    def _extract_all_sql_blocks(self, llm_output: str) -> List[Tuple[str, str]]:
+        """
+        Extracts every fenced SQL block from a multi-query LLM output.
+
+        :param llm_output: The output text from the LLM.
+        :return: A list of (query, comment) tuples; blocks without SQL are dropped.
+        """
+        blocks = []
+        for match in _SQL_BLOCK_RE.finditer(llm_output):
+            query, comment = self._block_query_and_comment(match)
+            if query:
+                blocks.append((query, comment))
+        logger.debug("Extracted %d SQL blocks from LLM output.", len(blocks))
+        return blocks
+
+    def _block_query_and_comment(self, match) -> Tuple[str, str]:
+        """
+        Returns the (query, comment) pair captured by a _SQL_BLOCK_RE match.
+        """
+        comment = (match.group("comment") or "").strip() or NO_COMMENT
+        query = match.group("body").strip()
         logger.debug("Extracted query: '%s', comment: '%s'", query, comment)
         return query, comment
 
     def _log_query_to_file(self, query: str, comment: str, index: int):
         """
-        Logs the generated query to a SQL file.
+        Writes the generated query to the SQL log file's buffer.
 
         :param query: The SQL query string.
         :param comment: A brief comment describing the query.
         :param index: The sequential index of the query.
         """
-        # Use a simplified filename without timestamp
-        filename = f"query_{index}.sql"
-        filepath = self.logs_dir / filename
-        filepath.write_text(f"-- {comment}\n{query}\n", encoding="utf-8")
-        logger.info("Logged query #%d to file: %s", index, filename)
+        self._log_fp.write(f"-- Query #{index}: {comment}\n{query}\n\n")
+        logger.info("Logged query #%d.", index)
+
+    def _flush_query_log(self):
+        """
+        Writes buffered queries out to the SQL log file.
+        """
+        if not self._log_fp.closed:
+            self._log_fp.flush()
+
+    def _batch_messages(self, system_prompt: str, count: int, previous_comments: List[str]) -> List[dict]:
+        """
+        Builds the message list requesting one batch of queries.
+
+        Earlier rounds are represented only by a one-line summary of the previous round's
+        purposes, so the prompt stays the same size however many queries were generated.
+
+        :param system_prompt: The system prompt describing the schema and goal.
+        :param count: The number of queries to request.
+        :param previous_comments: Purpose comments of the queries produced in the previous round.
+        :return: The messages for the LLM call.
+        """
+        messages = [{"role": "system", "content": system_prompt}]
+        request = f"Please provide {count} distinct SQL queries, each in its own fenced code block."
+        if previous_comments:
+            messages.append(
+                {"role": "assistant", "content": f"(previous queries produced: {'; '.join(previous_comments)})"}
+            )
+            request += " They must differ from the previous queries."
+        messages.append({"role": "user", "content": request})
+        return messages
+
+    async def _agenerate_batch(
+        self, semaphore: asyncio.Semaphore, messages: List[dict], count: int
+    ) -> List[Tuple[str, str]]:
+        """
+        Requests one batch of queries without blocking the event loop.
+
+        The blocking client call runs in a worker thread, so independent batches
+        overlap their network round-trips.
+        """
+        async with semaphore:
+            llm_output = await asyncio.to_thread(
+                self._generate_llm_message,
+                messages,
+                max_output_tokens=MAX_OUTPUT_TOKENS_PER_QUERY * count,
+            )
+        logger.debug("LLM output for batch of %d: %s", count, llm_output)
+        return self._extract_all_sql_blocks(llm_output)[:count]
+
+    async def _agenerate_round(
+        self, system_prompt: str, counts: List[int], concurrency: int, previous_comments: List[str]
+    ) -> list:
+        """
+        Requests all batches of a round concurrently, at most ``concurrency`` in flight.
+
+        :return: One list of (query, comment) tuples, or the raised exception, per batch.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(
+            *[
+                self._agenerate_batch(
+                    semaphore, self._batch_messages(system_prompt, count, previous_comments), count
+                )
+                for count in counts
+            ],
+            return_exceptions=True,
+        )
 
-    def generate_queries(self, goal: str, num_queries: int):
+    def generate_queries(self, goal: str, num_queries: int, batch_size: int = 5, concurrency: int = 4):
         """
         Generates a specified number of queries based on the provided goal, 
         logs each query, and places them on the shared queue.
+
+        Queries are requested in batches of up to ``batch_size`` per LLM call, and up to
+        ``concurrency`` batches are in flight at once. Rounds are repeated until
+        ``num_queries`` queries were produced or a round yields no SQL at all.
         """
         system_prompt = f"""
 You are an expert data scientist and SQL specialist. You have the following schema:
@@ -173,37 +331,57 @@ You are an expert data scientist and SQL specialist. You have the following sche
 
 The user's goal is: {goal}
 
-IMPORTANT: Generate ONLY ONE query per prompt that references ONLY the columns and tables listed in the schema above. Do NOT introduce any columns or tables that are not present in the schema. Ensure that the SQL is valid SQL.
-Generate a valid SQL query, using the Postgres syntax, that is complex and, if applicable, involves multiple joins.
-Include a short comment (like '-- Purpose: ...') as the first line inside a fenced SQL code block:
+IMPORTANT: Every query must reference ONLY the columns and tables listed in the schema above. Do NOT introduce any columns or tables that are not present in the schema. Ensure that the SQL is valid SQL.
+Generate valid SQL queries, using the Postgres syntax, that are complex and, if applicable, involve multiple joins.
+Emit each query in its own fenced SQL code block, with a short comment (like '-- Purpose: ...') as the first line:
 ```sql
 -- Purpose: ...
 SELECT ...
 ```
+If you cannot come up with any further distinct queries, reply with only {DONE_TOKEN}.
         """.strip()
-        
-        for i in range(1, num_queries + 1):
-            messages = [{"role": "system", "content": system_prompt}]
-            user_prompt = "Please provide one SQL query in a fenced code block."
-            messages.append({"role": "user", "content": user_prompt})
-            llm_output = self._generate_llm_message(messages)
-            logger.debug("LLM output for query %d: %s", i, llm_output)
-            query_str, comment = self._extract_sql_query_and_comment(llm_output)
-            if not query_str.strip():
-                logger.warning("No SQL found in LLM output for query %d; skipping.", i)
-                continue
-            self._log_query_to_file(query_str, comment, i)
-            msg = QueryMessage(query=query_str, comment=comment)
-            self.shared_queue.put(msg)
-            logger.info("Placed query #%d on shared queue: %s", i, msg)
-        logger.info("Finished generating %d queries.", num_queries)
-
-    def __del__(self):
-        """
-        Cleanup the stored OpenAI client if necessary.
-        """
-        if hasattr(self, 'client'):
-            del self.client
+
+        index = 0
+        previous_comments: List[str] = []
+        try:
+            while index < num_queries:
+                remaining = num_queries - index
+                counts = [min(batch_size, remaining - start) for start in range(0, remaining, batch_size)]
+                results = asyncio.run(
+                    self._agenerate_round(system_prompt, counts, concurrency, previous_comments)
+                )
+                produced = []
+                for blocks in results:
+                    if isinstance(blocks, Exception):
+                        logger.error("LLM batch request failed: %s", blocks)
+                        continue
+                    batch = []
+                    for query_str, comment in blocks:
+                        index += 1
+                        produced.append(comment)
+                        self._log_query_to_file(query_str, comment, index)
+                        batch.append(QueryMessage(query=query_str, comment=comment))
+                        logger.info("Queued query #%d: %s", index, comment)
+                    # One queue operation per LLM response instead of one per query.
+                    self.shared_queue.put_batch(batch)
+                if not produced:
+                    logger.warning("No SQL found in LLM output after %d queries; stopping.", index)
+                    break
+                # One write per round keeps the log file current.
+                self._flush_query_log()
+                previous_comments = produced
+        finally:
+            self._flush_query_log()
+        logger.info("Finished generating %d queries.", index)
+
+    def close(self):
+        """
+        Closes the SQL log file, writing out any buffered queries, the pooled database
+        connections and the OpenAI client.
+        """
+        self._log_fp.close()
+        close_pool(self.connection_string)
+        super().close()
 
 
 def main():
@@ -1,9 +1,144 @@
-import openai
 import logging
-import psycopg2
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+# openai, httpx and psycopg2 are imported where first needed, so that processes which
+# never talk to the API or the database do not pay for loading them.
+if TYPE_CHECKING:
+    from psycopg2.pool import ThreadedConnectionPool
 
 logger = logging.getLogger(__name__)
 
+# Connection pools shared by every agent in the process, keyed by DSN.
+_POOLS: Dict[str, "ThreadedConnectionPool"] = {}
+_POOLS_LOCK = threading.Lock()
+
+# HTTP connection limits for the OpenAI client, sized for concurrent LLM requests.
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+# Seconds an idle connection is kept. httpx's default of 5 s is shorter than the gaps between
+# LLM calls (a generation round, or the runner waiting on the generator), forcing new handshakes.
+HTTP_KEEPALIVE_EXPIRY = 120.0
+
+SCHEMA_QUERY = """
+    SELECT table_schema, table_name, column_name
+    FROM information_schema.columns
+    WHERE table_schema NOT IN ('information_schema', 'pg_catalog')
+    ORDER BY table_schema, table_name, ordinal_position
+"""
+_SCHEMA_STATEMENT = "sqlagent_schema"
+# Cheap catalog probe used to decide whether a cached schema is still current:
+# any DDL that adds, drops, renames or alters tables or columns rewrites rows
+# in pg_class/pg_attribute, changing their row counts or newest xmin.
+SCHEMA_VERSION_QUERY = """
+    SELECT (SELECT count(*) || ':' || max(xmin::text::bigint) FROM pg_class)
+        || '/' || (SELECT count(*) || ':' || max(xmin::text::bigint) FROM pg_attribute)
+"""
+
+# (full table name, columns) pairs in catalog order.
+Schema = List[Tuple[str, List[str]]]
+# Pooled connections on which _SCHEMA_STATEMENT has already been prepared.
+_PREPARED_CONNECTIONS = weakref.WeakSet()
+
+
+def connection_pool(dsn: str, minconn: int = 1, maxconn: int = 4) -> "ThreadedConnectionPool":
+    """
+    Returns the process-wide pool for ``dsn``, creating it on first use.
+    A caller that needs more connections than the existing pool allows raises its limits.
+
+    psycopg2 pools keep idle connections on a stack (returned with append, lent with pop), so
+    the most recently used backend, with the warmest caches and prepared statements, is reused
+    first and rarely used extra connections are the ones that age out.
+
+    :param minconn: Connections kept open while idle; more are closed when returned.
+    :param maxconn: Connections that may be lent out at once.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(dsn)
+        if pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            pool = _POOLS[dsn] = ThreadedConnectionPool(minconn=minconn, maxconn=maxconn, dsn=dsn)
+        else:
+            # psycopg2 only reads these limits when lending and returning connections,
+            # so raising them in place is safe.
+            pool.minconn = max(pool.minconn, minconn)
+            pool.maxconn = max(pool.maxconn, maxconn)
+    return pool
+
+
+def close_pool(dsn: str):
+    """
+    Closes every connection of the process-wide pool for ``dsn``, if one exists.
+    A later pooled_connection() for the same DSN starts a new pool.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.pop(dsn, None)
+    if pool is not None:
+        pool.closeall()
+
+
+@contextmanager
+def pooled_connection(dsn: str):
+    """
+    Borrows a connection from the process-wide pool for ``dsn``, creating the pool on first use.
+    Commits on success, rolls back on error, and always returns the connection to the pool.
+    """
+    pool = connection_pool(dsn)
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def fetch_schema_rows(conn) -> List[tuple]:
+    """
+    Runs SCHEMA_QUERY on ``conn`` as a server-side prepared statement.
+    The statement is prepared once per connection, so later discoveries skip parsing and planning.
+
+    :return: (table_schema, table_name, column_name) rows in schema order.
+    """
+    with conn.cursor() as cur:
+        if conn not in _PREPARED_CONNECTIONS:
+            cur.execute(f"PREPARE {_SCHEMA_STATEMENT} AS {SCHEMA_QUERY}")
+            _PREPARED_CONNECTIONS.add(conn)
+        cur.execute(f"EXECUTE {_SCHEMA_STATEMENT}")
+        return cur.fetchall()
+
+
+def fetch_schema_version(conn) -> str:
+    """
+    Runs SCHEMA_VERSION_QUERY on ``conn``; far cheaper than rediscovering the schema.
+    """
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_VERSION_QUERY)
+        return str(cur.fetchone()[0])
+
+
+def schema_from_rows(rows: List[tuple]) -> Schema:
+    """
+    Groups SCHEMA_QUERY rows into (table, columns) pairs.
+    The rows arrive sorted by table, so a table ends as soon as the next one starts.
+    """
+    schema = []
+    current_schema = current_table = None
+    for (schema_name, table, column) in rows:
+        # Compare the name parts directly; the full name is only formatted once per table.
+        if table != current_table or schema_name != current_schema:
+            current_schema, current_table = schema_name, table
+            columns = []
+            schema.append((f"{schema_name}.{table}", columns))
+        columns.append(column)
+    return schema
+
+
 class BaseAIAgent:
     """
     Base AI Agent that encapsulates common functionality for interfacing with the OpenAI API.
@@ -12,7 +147,21 @@ class BaseAIAgent:
     def __init__(self, model_name: str, temperature: float = 0.7):
         self.model_name = model_name
         self.temperature = temperature
-        self.client = openai.OpenAI()  # Create and store the client once during construction
+        import httpx
+        import openai
+        # Create and store the client once during construction. HTTP/2 multiplexes concurrent
+        # requests over one TLS connection, and the pool is larger than httpx's default.
+        self.client = openai.OpenAI(
+            http_client=httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+        )
 
     def generate_response(self, input_data) -> str:
         """
@@ -21,39 +170,32 @@ class BaseAIAgent:
         """
         raise NotImplementedError("Subclasses must implement generate_response.")
 
-    def _discover_schema(self, connection_string: str) -> dict:
+    def _discover_schema(self, connection_string: str) -> Schema:
         """
         Retrieves the database schema from INFORMATION_SCHEMA.
         """
-        schema_dict = {}
-        query = """
-            SELECT table_schema, table_name, column_name
-            FROM information_schema.columns
-            WHERE table_schema NOT IN ('information_schema', 'pg_catalog')
-            ORDER BY table_schema, table_name, ordinal_position
-        """
         try:
-            with psycopg2.connect(connection_string) as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query)
-                    rows = cur.fetchall()
-            for (schema, table, column) in rows:
-                full_name = f"{schema}.{table}"
-                schema_dict.setdefault(full_name, []).append(column)
-            return schema_dict
+            with pooled_connection(connection_string) as conn:
+                rows = fetch_schema_rows(conn)
+            return schema_from_rows(rows)
         except Exception as e:
             logger.error("Schema discovery failed: %s", e)
-            return {}
+            return []
 
-    def _format_schema_for_prompt(self, schema_dict: dict) -> str:
+    def _format_schema_for_prompt(self, schema: Schema) -> str:
         """
-        Formats the schema dictionary into a string for LLM context.
+        Formats the schema into a string for LLM context.
         """
-        lines = []
-        for table, cols in schema_dict.items():
-            lines.append(f"Table: {table}\n  Columns: {', '.join(cols)}\n")
-        return "\n".join(lines)
+        return "\n".join(f"Table: {table}\n  Columns: {', '.join(cols)}\n" for table, cols in schema)
+
+    def close(self):
+        """
+        Closes the OpenAI client's HTTP connections. The agent cannot make requests afterwards.
+        """
+        self.client.close()
+
+    def __enter__(self):
+        return self
 
-    def __del__(self):
-        if hasattr(self, 'client'):
-            del self.client
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
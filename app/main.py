@@ -7,6 +7,9 @@ import multiprocessing
 from queue_manager.shared_queue import SharedQueue
 from utils.global_utils import load_config, setup_logging, run_generator, run_runner
 
+# Modules the fork server imports once, before any child process is started.
+PRELOAD_MODULES = ["openai", "psycopg2", "agent.ai_query_generator", "workload.query_runner"]
+
 def main():
     # Initialize structured logging
     setup_logging()
@@ -14,12 +17,20 @@ def main():
     # Load configuration from JSON
     config = load_config()
     
+    # Start children from a fork server with the heavy modules already imported, so each
+    # child starts from copy-on-write pages instead of re-importing them (spawn where unavailable).
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(PRELOAD_MODULES)
+    else:
+        ctx = multiprocessing.get_context("spawn")
+
     # Create a shared queue for inter-process communication
-    shared_queue = SharedQueue()
+    shared_queue = SharedQueue(ctx=ctx)
 
     # Create separate processes for the AI query generator and the query runner
-    generator_proc = multiprocessing.Process(target=run_generator, args=(config, shared_queue))
-    runner_proc = multiprocessing.Process(target=run_runner, args=(config, shared_queue))
+    generator_proc = ctx.Process(target=run_generator, args=(config, shared_queue))
+    runner_proc = ctx.Process(target=run_runner, args=(config, shared_queue))
     
     # Start both processes
     generator_proc.start()
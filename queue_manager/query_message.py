@@ -3,20 +3,21 @@ Module: query_message
 This module defines the QueryMessage class which encapsulates a SQL query and its associated purpose comment.
 """
 
-class QueryMessage:
+from typing import NamedTuple
+
+
+class QueryMessage(NamedTuple):
     """
     Represents a SQL query message with a brief purpose comment.
-    """
+    Messages are immutable tuples with no per-instance __dict__: they are cheap to build and
+    pickle as a constructor call with the two strings, since one crosses processes per query.
 
-    def __init__(self, query: str, comment: str):
-        """
-        Initialize a QueryMessage.
+    :param query: The SQL query string.
+    :param comment: A brief description of the query's purpose.
+    """
 
-        :param query: The SQL query string.
-        :param comment: A brief description of the query's purpose.
-        """
-        self.query = query
-        self.comment = comment
+    query: str
+    comment: str
 
     def __repr__(self):
         return f"QueryMessage(comment='{self.comment}', query='{self.query[:50]}...')"
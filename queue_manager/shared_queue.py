@@ -1,24 +1,74 @@
 """
 Module: shared_queue
-This module provides the SharedQueue class, a wrapper around a multiprocessing.Queue,
+This module provides the SharedQueue class, a wrapper around an inter-process queue,
 to enable inter-process communication.
+By default messages travel through a shared-memory ring buffer (see shm_ring). The "queue"
+backend uses the optional faster-fifo package when installed, or a multiprocessing.Queue.
 """
 
 import multiprocessing
 import logging
+import queue
+from collections import deque
+
+from queue_manager.shm_ring import ShmCounters, ShmRingBuffer
+
+try:
+    from faster_fifo import Queue as FastQueue
+except ImportError:  # faster-fifo is optional and only builds on Linux and macOS.
+    FastQueue = None
 
 logger = logging.getLogger(__name__)
 
+# Size of the faster-fifo circular buffer holding pickled messages.
+FAST_QUEUE_MAX_BYTES = 10 * 1024 * 1024
+# faster-fifo has no "wait forever" timeout; this stands in for None on blocking gets.
+FAST_QUEUE_BLOCK_TIMEOUT = 1e9
+
+SHMEM_BACKEND = "shmem"
+QUEUE_BACKEND = "queue"
+
+# Upper bound on the items sent in one queue operation. Larger batches save little more
+# and make the consumer wait longer for the first item.
+MAX_BATCH_SIZE = 32
+
+
+class _Batch(list):
+    """
+    Several items sent with a single queue operation; get() unpacks it transparently.
+    """
+
 class SharedQueue:
     """
-    A wrapper for a multiprocessing.Queue to allow easy adaptation and extension.
+    A wrapper for an inter-process queue to allow easy adaptation and extension.
     """
 
-    def __init__(self):
-        """Initialize the shared queue."""
-        self.queue = multiprocessing.Queue()
-        self._size = 0  # Track the number of items in the queue
-        logger.debug("Initialized SharedQueue with size %d", self._size)
+    def __init__(self, ctx=None, backend: str = SHMEM_BACKEND):
+        """
+        Initialize the shared queue.
+
+        :param ctx: The multiprocessing context the consuming processes are started from;
+                    defaults to the global context.
+        :param backend: SHMEM_BACKEND for the shared-memory ring buffer, or QUEUE_BACKEND
+                        for faster-fifo / multiprocessing.Queue.
+        """
+        ctx = ctx or multiprocessing.get_context()
+        if backend == SHMEM_BACKEND:
+            self.queue = ShmRingBuffer(ctx=ctx)
+        elif backend != QUEUE_BACKEND:
+            raise ValueError(f"Unknown SharedQueue backend: {backend}")
+        elif FastQueue is not None:
+            self.queue = FastQueue(max_size_bytes=FAST_QUEUE_MAX_BYTES)
+        else:
+            self.queue = ctx.Queue()
+        self.backend = backend
+        # Put and get counts in shared memory, so every process sees the same values; they sit
+        # on separate cache lines, so producer and consumer never write to the same line. The
+        # ring buffer keeps its own shared counters and needs none.
+        self._counts = ShmCounters(ctx) if backend == QUEUE_BACKEND else None
+        # Items from a received batch not handed out yet; local to this process.
+        self._pending = deque()
+        logger.debug("Initialized SharedQueue with backend %s", backend)
 
     def put(self, item):
         """
@@ -27,8 +77,24 @@ class SharedQueue:
         :param item: The item to place on the queue.
         """
         self.queue.put(item)
-        self._size += 1
-        logger.debug("Item added to queue. New size: %d", self._size)
+        if self._counts is not None:
+            self._counts.add_puts(1)
+        logger.debug("Item added to queue.")
+
+    def put_batch(self, items):
+        """
+        Put several items onto the queue, sending up to MAX_BATCH_SIZE of them per queue
+        operation so they are pickled and transferred together.
+
+        :param items: The items to place on the queue, in order.
+        """
+        items = list(items)
+        for start in range(0, len(items), MAX_BATCH_SIZE):
+            chunk = _Batch(items[start:start + MAX_BATCH_SIZE])
+            self.queue.put(chunk)
+            if self._counts is not None:
+                self._counts.add_puts(len(chunk))
+        logger.debug("%d items added to queue.", len(items))
 
     def get(self, block=True, timeout=None):
         """
@@ -38,10 +104,47 @@ class SharedQueue:
         :param timeout: Timeout in seconds if blocking.
         :return: The item from the queue.
         """
+        item = self._take(block, timeout)
+        if self._counts is not None:
+            self._counts.add_gets(1)
+        logger.debug("Item removed from queue.")
+        return item
+
+    def get_batch(self, max_n: int, timeout=None) -> list:
+        """
+        Retrieve up to max_n items, blocking only for the first one.
+
+        :param max_n: Maximum number of items to return.
+        :param timeout: Timeout in seconds to wait for the first item.
+        :return: A non-empty list of items from the queue.
+        :raises queue.Empty: If no item arrived within the timeout.
+        """
+        items = [self._take(True, timeout)]
+        while len(items) < max_n:
+            try:
+                items.append(self._take(False, None))
+            except queue.Empty:
+                break
+        if self._counts is not None:
+            self._counts.add_gets(len(items))
+        logger.debug("%d items removed from queue.", len(items))
+        return items
+
+    def _take(self, block, timeout):
+        """
+        Returns the next item, unpacking batches into the local pending buffer.
+        Safe to call from several threads: each deque operation is atomic.
+        """
+        try:
+            return self._pending.popleft()
+        except IndexError:
+            pass
+        if timeout is None and self.backend == QUEUE_BACKEND and FastQueue is not None:
+            timeout = FAST_QUEUE_BLOCK_TIMEOUT
         item = self.queue.get(block, timeout)
-        if self._size > 0:  # Safeguard against going negative
-            self._size -= 1
-        logger.debug("Item removed from queue. New size: %d", self._size)
+        if isinstance(item, _Batch):
+            self._pending.extend(item[1:])
+            return item[0]
         return item
 
     def empty(self) -> bool:
@@ -50,4 +153,14 @@ class SharedQueue:
 
         :return: True if the queue is empty, False otherwise.
         """
-        return self._size == 0
+        if self._pending:
+            return False
+        if self._counts is None:
+            return self.queue.empty()
+        return self._counts.empty()
+
+    def __getstate__(self):
+        # Pending items belong to the process that received them.
+        state = self.__dict__.copy()
+        state["_pending"] = deque()
+        return state
@@ -0,0 +1,218 @@
+"""
+Module: shm_ring
+This module provides the ShmRingBuffer class, a bounded message ring buffer in shared memory
+used as the default SharedQueue transport between the generator and runner processes.
+It also provides ShmCounters, the shared put/get counts of SharedQueue's "queue" backend.
+"""
+
+import multiprocessing
+import pickle
+import queue
+import struct
+import time
+import weakref
+from multiprocessing import shared_memory
+
+# Shared segment layout: the producer's tail counter and the consumer's head counter sit on
+# separate 64-byte cache lines so the two sides never write to the same line, followed by
+# the data arena. Both counters grow monotonically; positions are taken modulo the capacity.
+_TAIL_OFFSET = 0
+_HEAD_OFFSET = 64
+_DATA_OFFSET = 128
+
+_COUNTER = struct.Struct("Q")
+_LENGTH = struct.Struct("I")
+# Length marker telling the consumer the next record starts at the beginning of the arena.
+_WRAP_MARKER = 0xFFFFFFFF
+
+# Non-blocking attempts a blocking get makes before sleeping on the semaphore.
+_SPIN_ATTEMPTS = 200
+# Pause between checks while a producer waits for the consumer to free space.
+_FULL_BACKOFF = 0.0005
+
+DEFAULT_CAPACITY = 4 * 1024 * 1024
+
+
+def _align(size: int) -> int:
+    """Rounds size up to a multiple of the length-prefix size, keeping records aligned."""
+    return (size + _LENGTH.size - 1) // _LENGTH.size * _LENGTH.size
+
+
+class ShmRingBuffer:
+    """
+    A bounded queue of pickled objects stored in a multiprocessing.shared_memory segment.
+
+    Each record is a length prefix followed by the pickled payload. Writers publish a record by
+    advancing the tail counter after it is fully written, then release a semaphore that counts
+    available records; readers acquire it, copy the record out and advance the head counter.
+    Producers and consumers are each serialized by their own lock, so several of either may share
+    one buffer. The buffer can be passed to child processes of the context it was created with.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, ctx=None):
+        """
+        Initialize the ring buffer.
+
+        :param capacity: Size of the data arena in bytes.
+        :param ctx: The multiprocessing context the sharing processes are started from.
+        """
+        ctx = ctx or multiprocessing.get_context()
+        self.capacity = _align(capacity)
+        self._shm = shared_memory.SharedMemory(create=True, size=_DATA_OFFSET + self.capacity)
+        self._items = ctx.Semaphore(0)
+        self._put_lock = ctx.Lock()
+        self._get_lock = ctx.Lock()
+        # Last head value seen by this producer; it only ever lags the real head, which is safe.
+        self._head_cache = 0
+        # The creating process owns the segment and removes it once the buffer is collected.
+        self._finalizer = weakref.finalize(self, _release, self._shm, True)
+
+    def __getstate__(self):
+        return self._shm.name, self.capacity, self._items, self._put_lock, self._get_lock
+
+    def __setstate__(self, state):
+        name, self.capacity, self._items, self._put_lock, self._get_lock = state
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._head_cache = 0
+        self._finalizer = weakref.finalize(self, _release, self._shm, False)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Pickle an item and append it to the buffer.
+
+        :param item: The item to place on the buffer.
+        :param block: Whether to wait for space when the buffer is full.
+        :param timeout: Maximum seconds to wait for space, or None to wait indefinitely.
+        :raises queue.Full: If no space became available in time.
+        :raises ValueError: If the pickled item needs more than half the buffer.
+        """
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        record = _align(_LENGTH.size + len(data))
+        # A record that does not fit before the end of the arena also uses up the remainder, so
+        # only records of at most half the arena are sure to fit once the buffer drains.
+        if record > self.capacity // 2:
+            raise ValueError(
+                f"Item of {len(data)} bytes does not fit in half of a {self.capacity}-byte buffer."
+            )
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buf = self._shm.buf
+        with self._put_lock:
+            tail = _COUNTER.unpack_from(buf, _TAIL_OFFSET)[0]
+            pos = tail % self.capacity
+            # A record never straddles the end of the arena; skip the remainder instead.
+            padding = self.capacity - pos if self.capacity - pos < record else 0
+            needed = padding + record
+            while self.capacity - (tail - self._head_cache) < needed:
+                self._head_cache = _COUNTER.unpack_from(buf, _HEAD_OFFSET)[0]
+                if self.capacity - (tail - self._head_cache) >= needed:
+                    break
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise queue.Full
+                time.sleep(_FULL_BACKOFF)
+            if padding:
+                _LENGTH.pack_into(buf, _DATA_OFFSET + pos, _WRAP_MARKER)
+                pos = 0
+            start = _DATA_OFFSET + pos + _LENGTH.size
+            _LENGTH.pack_into(buf, _DATA_OFFSET + pos, len(data))
+            buf[start:start + len(data)] = data
+            # Publish the record only once it is completely written.
+            _COUNTER.pack_into(buf, _TAIL_OFFSET, tail + needed)
+        self._items.release()
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and unpickle the oldest item in the buffer.
+
+        :param block: Whether to wait for an item when the buffer is empty.
+        :param timeout: Maximum seconds to wait, or None to wait indefinitely.
+        :return: The item.
+        :raises queue.Empty: If no item became available in time.
+        """
+        if not self._acquire(block, timeout):
+            raise queue.Empty
+        buf = self._shm.buf
+        with self._get_lock:
+            head = _COUNTER.unpack_from(buf, _HEAD_OFFSET)[0]
+            pos = head % self.capacity
+            length = _LENGTH.unpack_from(buf, _DATA_OFFSET + pos)[0]
+            if length == _WRAP_MARKER:
+                head += self.capacity - pos
+                pos = 0
+                length = _LENGTH.unpack_from(buf, _DATA_OFFSET)[0]
+            start = _DATA_OFFSET + pos + _LENGTH.size
+            data = bytes(buf[start:start + length])
+            _COUNTER.pack_into(buf, _HEAD_OFFSET, head + _align(_LENGTH.size + length))
+        return pickle.loads(data)
+
+    def _acquire(self, block, timeout) -> bool:
+        # Spin briefly first: a record published within microseconds is taken without sleeping.
+        for _ in range(_SPIN_ATTEMPTS if block else 1):
+            if self._items.acquire(block=False):
+                return True
+        if not block:
+            return False
+        return self._items.acquire(timeout=timeout)
+
+    def empty(self) -> bool:
+        """
+        Check if the buffer holds no unread records, as seen by every attached process.
+        """
+        buf = self._shm.buf
+        return _COUNTER.unpack_from(buf, _HEAD_OFFSET)[0] == _COUNTER.unpack_from(buf, _TAIL_OFFSET)[0]
+
+
+class ShmCounters:
+    """
+    A pair of monotonically increasing put and get counters in shared memory.
+
+    The counters use the ring buffer's layout: each sits on its own cache line, so producers and
+    consumers never write to the same line. Each side is serialized by its own lock, which is
+    uncontended while a single process produces and a single process consumes.
+    """
+
+    def __init__(self, ctx=None):
+        """
+        Initialize both counters to zero.
+
+        :param ctx: The multiprocessing context the sharing processes are started from.
+        """
+        ctx = ctx or multiprocessing.get_context()
+        self._shm = shared_memory.SharedMemory(create=True, size=_DATA_OFFSET)
+        self._put_lock = ctx.Lock()
+        self._get_lock = ctx.Lock()
+        self._finalizer = weakref.finalize(self, _release, self._shm, True)
+
+    def __getstate__(self):
+        return self._shm.name, self._put_lock, self._get_lock
+
+    def __setstate__(self, state):
+        name, self._put_lock, self._get_lock = state
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._finalizer = weakref.finalize(self, _release, self._shm, False)
+
+    def add_puts(self, n: int):
+        """Records n items put."""
+        with self._put_lock:
+            _add(self._shm.buf, _TAIL_OFFSET, n)
+
+    def add_gets(self, n: int):
+        """Records n items taken."""
+        with self._get_lock:
+            _add(self._shm.buf, _HEAD_OFFSET, n)
+
+    def empty(self) -> bool:
+        """
+        Check if every item put has been taken, as seen by every attached process.
+        """
+        buf = self._shm.buf
+        return _COUNTER.unpack_from(buf, _HEAD_OFFSET)[0] == _COUNTER.unpack_from(buf, _TAIL_OFFSET)[0]
+
+
+def _add(buf, offset, n):
+    _COUNTER.pack_into(buf, offset, _COUNTER.unpack_from(buf, offset)[0] + n)
+
+
+def _release(shm, owner):
+    shm.close()
+    if owner:
+        shm.unlink()
@@ -4,8 +4,10 @@ setup(
     name='my_app',                      # replace with your app's name
     version='0.1.0',
     packages=find_packages(),
+    python_requires=">=3.10",
     install_requires=[
-        "openai>=0.27.5",  # updated to ensure new SDK is installed
+        "openai>=1.66",  # first release with the Responses API
+        "httpx[http2]>=0.23",  # HTTP/2 transport for the OpenAI client
         "psycopg2-binary==2.9.6"
     ],
     entry_points={
@@ -1,7 +1,9 @@
 import unittest
 from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
 from queue_manager.shared_queue import SharedQueue
-from agent.ai_query_generator import AIQueryGenerator
+from agent.ai_query_generator import AIQueryGenerator, _read_stream_until_done
+from agent.base_ai_agent import close_pool, connection_pool, fetch_schema_rows, schema_from_rows
 from pathlib import Path
 import shutil
 
@@ -13,6 +15,7 @@ class DummyAIQueryGenerator(AIQueryGenerator):
         self.shared_queue = shared_queue
         self.logs_dir = Path("logs/sql")
         self.logs_dir.mkdir(parents=True, exist_ok=True)
+        self._log_fp = open(self.logs_dir / "queries.sql", "a", encoding="utf-8", buffering=1 << 16)
         self.model_name = "dummy-model"
         self.temperature = 0.0
         self.schema_text = "Dummy schema for testing"
@@ -30,7 +33,7 @@ SELECT * FROM dummy_table_2;
         ]
         self.response_index = 0
 
-    def _generate_llm_message(self, messages):
+    def _generate_llm_message(self, messages, **kwargs):
         response = self.responses[self.response_index]
         self.response_index += 1
         return response
@@ -44,6 +47,7 @@ class TestAgent(unittest.TestCase):
 
     def tearDown(self):
         """Clean up test artifacts."""
+        self.generator._log_fp.close()
         if self.logs_dir.exists():
             shutil.rmtree(self.logs_dir)
 
@@ -57,6 +61,22 @@ SELECT * FROM dummy_table_1;
         self.assertIn("SELECT * FROM dummy_table_1;", query)  # Match dummy response
         self.assertEqual(comment, "Dummy test query")
 
+    def test_extract_all_sql_blocks(self):
+        """Test extracting every SQL block from a multi-query LLM output."""
+        dummy_response = """```sql
+-- Purpose: First query
+SELECT 1;
+```
+Some prose between blocks.
+```sql
+-- Purpose: Second query
+SELECT 2;
+```
+```sql
+```"""
+        blocks = self.generator._extract_all_sql_blocks(dummy_response)
+        self.assertEqual(blocks, [("SELECT 1;", "First query"), ("SELECT 2;", "Second query")])
+
     def test_generate_queries_queues_messages(self):
         """Test that queries are generated and placed on the shared queue."""
         self.generator.generate_queries("Test goal", num_queries=2)
@@ -69,16 +89,114 @@ SELECT * FROM dummy_table_1;
         self.assertIn("SELECT * FROM dummy_table_2;", messages[1].query)
         self.assertEqual(messages[1].comment, "Dummy test query 2")
 
-    @patch("agent.ai_query_generator.Path.write_text")
-    def test_log_query_to_file(self, mock_write_text):
-        """Test that queries are logged to files."""
+    def test_load_schema_uses_cache_until_version_changes(self):
+        """Test that the schema cache is reused only while the version token matches."""
+        self.generator.schema_cache_dir = self.logs_dir / ".schema_cache"
+        self.generator.schema_cache_dir.mkdir(parents=True, exist_ok=True)
+        schema = [("public.dummy", ["id", "name"])]
+        with patch.object(self.generator, "_schema_version", return_value="v1"), \
+                patch.object(self.generator, "_discover_schema", return_value=schema) as discover:
+            self.assertEqual(self.generator._load_schema(), schema)
+            self.assertEqual(self.generator._load_schema(), schema)
+            self.assertEqual(discover.call_count, 1)
+        with patch.object(self.generator, "_schema_version", return_value="v2"), \
+                patch.object(self.generator, "_discover_schema", return_value=schema) as discover:
+            self.generator._load_schema()
+            self.assertEqual(discover.call_count, 1)
+
+    def test_fetch_schema_rows_prepares_once_per_connection(self):
+        """Test that the schema query is prepared only on first use of a connection."""
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        fetch_schema_rows(conn)
+        fetch_schema_rows(conn)
+        statements = [call.args[0] for call in cur.execute.call_args_list]
+        self.assertTrue(statements[0].startswith("PREPARE sqlagent_schema AS"))
+        self.assertEqual(statements[1:], ["EXECUTE sqlagent_schema", "EXECUTE sqlagent_schema"])
+
+    def test_connection_pool_is_shared_and_grows(self):
+        """Test that one pool is kept per DSN and a larger request raises its limits."""
+        with patch("psycopg2.pool.ThreadedConnectionPool") as pool_cls, \
+                patch.dict("agent.base_ai_agent._POOLS", clear=True):
+            pool_cls.return_value = SimpleNamespace(minconn=1, maxconn=4)
+            pool = connection_pool("dsn")
+            self.assertIs(connection_pool("dsn", minconn=5, maxconn=10), pool)
+            pool_cls.assert_called_once_with(minconn=1, maxconn=4, dsn="dsn")
+            self.assertEqual((pool.minconn, pool.maxconn), (5, 10))
+
+    def test_close_pool_closes_and_forgets_pool(self):
+        """Test that closing a pool closes its connections and a new one is created next time."""
+        with patch("psycopg2.pool.ThreadedConnectionPool") as pool_cls, \
+                patch.dict("agent.base_ai_agent._POOLS", clear=True):
+            pool = connection_pool("dsn")
+            close_pool("dsn")
+            pool.closeall.assert_called_once_with()
+            close_pool("dsn")
+            connection_pool("dsn")
+            self.assertEqual(pool_cls.call_count, 2)
+
+    def test_close_closes_connection_pool(self):
+        """Test that closing the generator also closes its pooled database connections."""
+        self.generator.client = MagicMock()
+        with patch("agent.ai_query_generator.close_pool") as close:
+            self.generator.close()
+        close.assert_called_once_with("dummy_connection")
+        self.generator.client.close.assert_called_once_with()
+
+    def test_read_stream_until_done(self):
+        """Test that streaming stops at DONE outside a fence but not inside one."""
+        deltas = ["```sql\nSELECT 'DO", "NE';\n``", "`\nDO", "NE", "\n", "never read"]
+        stream = MagicMock()
+        stream.__iter__.return_value = iter(
+            [SimpleNamespace(type="response.output_text.delta", delta=d) for d in deltas]
+        )
+        text = _read_stream_until_done(stream)
+        self.assertEqual(text, "```sql\nSELECT 'DONE';\n```\nDONE\n")
+        stream.close.assert_called_once()
+
+    def test_read_stream_ignores_done_inside_prose(self):
+        """Test that DONE inside a word or later in the prose does not end the stream."""
+        deltas = ["Here are queries on ABAN", "DONED carts, DONE right:\n", "```sql\nSELECT 1;\n```\n"]
+        stream = MagicMock()
+        stream.__iter__.return_value = iter(
+            [SimpleNamespace(type="response.output_text.delta", delta=d) for d in deltas]
+        )
+        self.assertEqual(_read_stream_until_done(stream), "".join(deltas))
+        stream.close.assert_not_called()
+
+    def test_schema_from_rows_groups_columns_by_table(self):
+        """Test that ordered schema rows are grouped per table and formatted for the prompt."""
+        rows = [("public", "a", "id"), ("public", "a", "name"), ("sales", "b", "total")]
+        schema = schema_from_rows(rows)
+        self.assertEqual(schema, [("public.a", ["id", "name"]), ("sales.b", ["total"])])
+        self.assertEqual(
+            self.generator._format_schema_for_prompt(schema),
+            "Table: public.a\n  Columns: id, name\n\nTable: sales.b\n  Columns: total\n",
+        )
+
+    def test_log_query_to_file(self):
+        """Test that queries are buffered and then appended to the log file."""
         query = "SELECT * FROM dummy_table;"
         comment = "Dummy test query"
+        log_file = self.logs_dir / "queries.sql"
         self.generator._log_query_to_file(query, comment, index=1)
-        mock_write_text.assert_called_once()
-        args, kwargs = mock_write_text.call_args
-        self.assertIn("-- Dummy test query", args[0])
-        self.assertIn("SELECT * FROM dummy_table;", args[0])
+        self.assertEqual(log_file.read_text(encoding="utf-8"), "")
+        self.generator._flush_query_log()
+        content = log_file.read_text(encoding="utf-8")
+        self.assertIn("-- Query #1: Dummy test query", content)
+        self.assertIn("SELECT * FROM dummy_table;", content)
+
+    def test_generate_queries_keeps_prompt_bounded(self):
+        """Test that later rounds carry only a summary of the previous round."""
+        with patch.object(self.generator, "_generate_llm_message", side_effect=self.generator.responses) as llm:
+            self.generator.generate_queries("Test goal", num_queries=3, batch_size=3, concurrency=1)
+        first, second, third = (call.args[0] for call in llm.call_args_list)
+        self.assertEqual([m["role"] for m in first], ["system", "user"])
+        self.assertEqual([m["role"] for m in second], ["system", "assistant", "user"])
+        self.assertIn("Dummy test query 1", second[1]["content"])
+        self.assertEqual(len(third), len(second))
+        self.assertIn("Dummy test query 2", third[1]["content"])
+        self.assertNotIn("Dummy test query 1", third[1]["content"])
 
     def test_edge_case_no_sql_in_response(self):
         """Test handling of LLM output with no SQL query."""
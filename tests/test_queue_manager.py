@@ -1,8 +1,15 @@
 # tests/test_queue_manager.py
 
+import multiprocessing
+import pickle
+import queue
 import unittest
 from queue_manager.query_message import QueryMessage
-from queue_manager.shared_queue import SharedQueue
+from queue_manager.shared_queue import QUEUE_BACKEND, SharedQueue
+from queue_manager.shm_ring import ShmRingBuffer
+
+def _put_from_child(sq):
+    sq.put(QueryMessage("SELECT 1;", "From child"))
 
 class TestQueueManager(unittest.TestCase):
     def test_query_message_repr(self):
@@ -10,6 +17,13 @@ class TestQueueManager(unittest.TestCase):
         self.assertIn("Test query", repr(msg))
         self.assertIn("SELECT * FROM test_table;", repr(msg))
     
+    def test_query_message_is_immutable_and_pickles(self):
+        msg = QueryMessage("SELECT 1;", "Test query")
+        with self.assertRaises(AttributeError):
+            msg.query = "SELECT 2;"
+        self.assertFalse(hasattr(msg, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(msg)), msg)
+
     def test_shared_queue(self):
         sq = SharedQueue()
         self.assertTrue(sq.empty(), "Queue should be empty initially")
@@ -20,5 +34,72 @@ class TestQueueManager(unittest.TestCase):
         self.assertEqual(test_item, retrieved)
         self.assertTrue(sq.empty(), "Queue should be empty after retrieving the item")
 
+    def test_shared_queue_queue_backend(self):
+        sq = SharedQueue(backend=QUEUE_BACKEND)
+        sq.put("test_item")
+        self.assertFalse(sq.empty())
+        self.assertEqual(sq.get(timeout=5), "test_item")
+        self.assertTrue(sq.empty())
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs fork")
+    def test_shared_queue_empty_across_processes(self):
+        ctx = multiprocessing.get_context("fork")
+        for backend in ("shmem", QUEUE_BACKEND):
+            sq = SharedQueue(ctx=ctx, backend=backend)
+            child = ctx.Process(target=_put_from_child, args=(sq,))
+            child.start()
+            child.join()
+            self.assertFalse(sq.empty(), f"{backend}: item put by a child must be visible")
+            self.assertEqual(sq.get(timeout=5).comment, "From child")
+            self.assertTrue(sq.empty())
+
+    def test_put_batch_and_get_batch(self):
+        for backend in ("shmem", QUEUE_BACKEND):
+            sq = SharedQueue(backend=backend)
+            sq.put_batch([QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(40)])
+            sq.put(QueryMessage("SELECT 40;", "Query 40"))
+            first = sq.get_batch(8, timeout=1)
+            self.assertEqual([m.comment for m in first], [f"Query {i}" for i in range(8)])
+            self.assertEqual(sq.get(timeout=1).comment, "Query 8")
+            rest = sq.get_batch(100, timeout=1)
+            while not sq.empty():
+                rest.extend(sq.get_batch(100, timeout=1))
+            self.assertEqual([m.comment for m in rest], [f"Query {i}" for i in range(9, 41)])
+            with self.assertRaises(queue.Empty):
+                sq.get_batch(4, timeout=0.01)
+
+    def test_ring_buffer_wraps_around(self):
+        ring = ShmRingBuffer(capacity=256)
+        for i in range(50):
+            msg = QueryMessage(f"SELECT {i};", f"Query {i}")
+            ring.put(msg)
+            self.assertEqual(ring.get(), msg)
+        self.assertTrue(ring.empty())
+
+    def test_ring_buffer_full_and_empty(self):
+        ring = ShmRingBuffer(capacity=128)
+        with self.assertRaises(queue.Empty):
+            ring.get(block=False)
+        ring.put("x" * 40)
+        ring.put("x" * 40)
+        with self.assertRaises(queue.Full):
+            ring.put("y" * 40, timeout=0.01)
+        with self.assertRaises(ValueError):
+            ring.put("z" * 100)
+
+    def test_ring_buffer_rejects_items_over_half_capacity(self):
+        ring = ShmRingBuffer(capacity=64)
+        ring.put("x")
+        ring.get()
+        # Past the start of the arena this would need the wrap padding too and never fit.
+        with self.assertRaises(ValueError):
+            ring.put("y" * 30, timeout=1)
+        ring = ShmRingBuffer(capacity=128)
+        for i in range(40):
+            ring.put("a" * (i % 7))
+            ring.get()
+            ring.put("x" * 45, timeout=1)
+            self.assertEqual(ring.get(block=False), "x" * 45)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,44 @@
 # tests/test_utils.py
 
 import unittest
+import copy
 import os
 import json
-from utils.global_utils import extract_fenced_code, current_timestamp, load_config, setup_logging
+import logging
+import logging.handlers
+import subprocess
+import sys
+import tempfile
+from unittest.mock import MagicMock, patch
+from utils import global_utils
+from utils.global_utils import extract_fenced_code, current_timestamp, load_config, setup_logging, stop_logging
 
 class TestGlobalUtils(unittest.TestCase):
+    def isolate_logging(self):
+        """
+        Points the log file at a temporary directory and, after the test, stops logging and
+        restores the root logger, so later tests neither write to logs/app.log nor log to the console.
+        """
+        logs = tempfile.TemporaryDirectory()
+        self.addCleanup(logs.cleanup)
+        config = copy.deepcopy(global_utils.LOGGING_CONFIG)
+        config["handlers"]["file"]["filename"] = os.path.join(logs.name, "app.log")
+        patcher = patch.object(global_utils, "LOGGING_CONFIG", config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+
+        def restore():
+            stop_logging()
+            for handler in root.handlers:
+                if handler not in handlers:
+                    handler.close()
+            root.handlers = handlers
+            root.setLevel(level)
+
+        self.addCleanup(restore)
+
     def test_extract_fenced_code(self):
         text = """```sql
 -- Purpose: Test query
@@ -15,6 +48,13 @@ SELECT * FROM test_table;
         self.assertIn("SELECT * FROM test_table;", code)
         self.assertNotIn("```", code)
 
+    def test_extract_fenced_code_edge_cases(self):
+        text = "Intro\n```python\nprint(1)\n```\n```SQL\nSELECT 1;\n```"
+        self.assertEqual(extract_fenced_code(text, language="sql"), "SELECT 1;")
+        # Without a closing fence the text is returned unchanged, as before.
+        self.assertEqual(extract_fenced_code(" ```sql\nSELECT 1; "), "```sql\nSELECT 1;")
+        self.assertEqual(extract_fenced_code(" no code "), "no code")
+
     def test_current_timestamp(self):
         ts = current_timestamp()
         # Check the format (YYYYMMDD_HHMMSS) which is 15 characters long.
@@ -29,13 +69,37 @@ SELECT * FROM test_table;
         loaded_config = load_config(temp_filename)
         self.assertEqual(loaded_config, temp_config)
         os.remove(temp_filename)
+        # Later calls are served from the cache without touching the file.
+        self.assertIs(load_config(temp_filename), loaded_config)
     
     def test_setup_logging(self):
+        self.isolate_logging()
         # Ensure setup_logging runs without error.
         try:
             setup_logging()
         except Exception as e:
             self.fail(f"setup_logging() raised an exception: {e}")
 
+    def test_stop_logging_flushes_queued_records(self):
+        self.isolate_logging()
+        setup_logging()
+        handler = MagicMock(level=logging.DEBUG)
+        listener = global_utils._listener
+        listener.handlers = listener.handlers + (handler,)
+        logging.getLogger("test_utils").info("queued record")
+        stop_logging()
+        self.assertIsNone(global_utils._listener)
+        messages = [call.args[0].getMessage() for call in handler.handle.call_args_list]
+        self.assertIn("queued record", messages)
+        self.assertNotIsInstance(logging.getLogger().handlers[0], logging.handlers.QueueHandler)
+
+    def test_entry_points_do_not_load_openai(self):
+        # A fresh interpreter, since this one may already have loaded the SDK.
+        code = ("import sys, agent.ai_query_generator, workload.query_runner, utils.global_utils; "
+                "print('openai' in sys.modules)")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "False")
+
 if __name__ == '__main__':
     unittest.main()
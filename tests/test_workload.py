@@ -1,36 +1,360 @@
 # tests/test_workload.py
 
+import tempfile
+import threading
+import time
 import unittest
+from unittest.mock import MagicMock, patch
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from queue_manager.shared_queue import SharedQueue
 from queue_manager.query_message import QueryMessage
-from workload.query_runner import QueryRunner
-
-# Create a dummy subclass for QueryRunner that bypasses actual DB calls.
-class DummyQueryRunner(QueryRunner):
-    def __init__(self, connection_string, shared_queue, logs_dir="logs/runner", concurrency=1, steady_state_queries=None, steady_state_interval=0.1):
-        self.connection_string = connection_string
-        self.shared_queue = shared_queue
-        self.logs_dir = logs_dir
-        self.concurrency = concurrency
-        self.steady_state_queries = steady_state_queries or []
-        self.steady_state_interval = steady_state_interval
-        self._stop_steady_state = False
-
-    def _execute_query(self, query_str, comment):
-        # Simulate query execution by returning a dummy message.
-        return f"Dummy executed: {comment}"
+from agent.base_ai_agent import _POOLS, pooled_connection
+from workload.query_runner import QueryRunner, _returns_rows_only
+
+def fake_connection(*args, **kwargs):
+    """Stands in for psycopg2.connect(); the real connection pool lends and takes back what it returns."""
+    conn = MagicMock(closed=0, autocommit=False)
+    conn.info.transaction_status = TRANSACTION_STATUS_IDLE
+    return conn
 
 class TestWorkload(unittest.TestCase):
+    def make_runner(self, connect=fake_connection, **kwargs):
+        """
+        Builds a real QueryRunner whose connection pools are filled by ``connect``.
+        The connections made are collected in self.connections.
+        """
+        logs = tempfile.TemporaryDirectory()
+        self.addCleanup(logs.cleanup)
+        self.connections = []
+
+        def connect_and_record(*args, **connect_kwargs):
+            conn = connect(*args, **connect_kwargs)
+            self.connections.append(conn)
+            return conn
+
+        for patcher in (
+            patch.dict("os.environ", {"OPENAI_API_KEY": "test"}),
+            patch.dict("agent.base_ai_agent._POOLS", clear=True),
+            patch("psycopg2.connect", side_effect=connect_and_record),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        kwargs.setdefault("shared_queue", SharedQueue())
+        kwargs.setdefault("concurrency", 1)
+        kwargs.setdefault("connection_string", "dbname=test")
+        runner = QueryRunner(logs_dir=logs.name, **kwargs)
+        self.addCleanup(runner.close)
+        return runner
+
+    def make_stub_runner(self, **kwargs):
+        """
+        make_runner() with validation approving every query and execution returning
+        "Dummy executed: <comment>" instead of running SQL.
+        """
+        runner = self.make_runner(**kwargs)
+        for name, stub in (
+            ("validate_queries", lambda messages: [True] * len(messages)),
+            ("_execute_query", lambda query_str, comment, prepared=False: f"Dummy executed: {comment}"),
+        ):
+            patcher = patch.object(runner, name, side_effect=stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return runner
+
+    def query_cursor(self):
+        """
+        The cursor of the runner's first query connection. A single-threaded test is always lent
+        that connection, since the pool opens one per worker and reuses the last one returned.
+        """
+        return self.connections[0].cursor.return_value.__enter__.return_value
+
     def test_run_concurrent_queries(self):
         shared_queue = SharedQueue()
         # Place two dummy query messages in the queue.
         shared_queue.put(QueryMessage("SELECT * FROM dummy;", "Dummy query 1"))
         shared_queue.put(QueryMessage("SELECT 1;", "Dummy query 2"))
-        runner = DummyQueryRunner("dummy_connection", shared_queue, concurrency=2)
+        runner = self.make_stub_runner(shared_queue=shared_queue, concurrency=2)
         results = runner.run_concurrent_queries(timeout=2)
         self.assertEqual(len(results), 2)
         self.assertTrue(all("Dummy executed:" in res for res in results))
-    
+
+    def test_run_concurrent_queries_batched(self):
+        shared_queue = SharedQueue()
+        shared_queue.put_batch([QueryMessage(f"SELECT {i};", f"Batched query {i}") for i in range(10)])
+        runner = self.make_stub_runner(shared_queue=shared_queue, concurrency=2)
+        results = runner.run_concurrent_queries(timeout=2)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(shared_queue.empty())
+
+    def test_run_concurrent_queries_stops_at_sentinel(self):
+        shared_queue = SharedQueue()
+        shared_queue.put(QueryMessage("SELECT 1;", "Dummy query 1"))
+        shared_queue.put(None)
+        runner = self.make_stub_runner(shared_queue=shared_queue, concurrency=2)
+        start = time.monotonic()
+        results = runner.run_concurrent_queries(timeout=30)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(results, ["Dummy executed: Dummy query 1"])
+
+    def test_validation_error_skips_batch_and_passes_sentinel_on(self):
+        shared_queue = SharedQueue()
+        shared_queue.put_batch([QueryMessage("SELECT 1;", "Query 1"), None])
+        runner = self.make_stub_runner(shared_queue=shared_queue)
+        runner.validate_queries = MagicMock(side_effect=AttributeError("boom"))
+        start = time.monotonic()
+        with patch("workload.query_runner.logger"):
+            results = runner.run_concurrent_queries(timeout=30)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(results, ["Query skipped due to failed validation: Query 1"])
+
+    def test_execution_overlaps_validation(self):
+        shared_queue = SharedQueue()
+        shared_queue.put_batch([QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(9)])
+        shared_queue.put(None)
+        executed = threading.Event()
+        overlapped = []
+        runner = self.make_stub_runner(shared_queue=shared_queue, concurrency=1)
+
+        def validate_queries(messages):
+            if len(messages) < 8:
+                # The first batch must run while the second one is still being validated.
+                overlapped.append(executed.wait(timeout=5))
+            return [True] * len(messages)
+
+        def execute_query(query_str, comment, prepared=False):
+            executed.set()
+            return f"Dummy executed: {comment}"
+
+        runner.validate_queries = validate_queries
+        runner._execute_query = execute_query
+        results = runner.run_concurrent_queries(timeout=10)
+        self.assertEqual(overlapped, [True])
+        self.assertEqual(len(results), 9)
+
+    def test_approved_queries_run_after_the_deadline(self):
+        runner = self.make_runner()
+        runner.shared_queue.put_batch([QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(4)])
+        runner.shared_queue.put(None)
+
+        def slow_execute(query_str, comment, prepared=False):
+            time.sleep(0.2)
+            return f"Executed: {comment}"
+
+        with patch.object(runner, "validate_queries", side_effect=lambda messages: [True] * len(messages)), \
+                patch.object(runner, "_execute_query", side_effect=slow_execute):
+            results = runner.run_concurrent_queries(timeout=0.3)
+        self.assertEqual(sorted(results), [f"Executed: Query {i}" for i in range(4)])
+
+    def test_validation_batches_run_concurrently(self):
+        shared_queue = SharedQueue()
+        shared_queue.put_batch([QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(8)])
+        shared_queue.put_batch([QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(8, 16)])
+        shared_queue.put(None)
+        both_in_flight = threading.Barrier(2, timeout=5)
+        runner = self.make_stub_runner(shared_queue=shared_queue, concurrency=2)
+
+        def validate_queries(messages):
+            both_in_flight.wait()
+            return [True] * len(messages)
+
+        runner.validate_queries = validate_queries
+        results = runner.run_concurrent_queries(timeout=10)
+        self.assertEqual(len(results), 16)
+        self.assertFalse(both_in_flight.broken)
+
+    def test_query_pool_admits_every_concurrent_borrower(self):
+        def slow_connection(*args, **kwargs):
+            conn = fake_connection()
+            conn.cursor.return_value.__enter__.return_value.execute.side_effect = lambda *a: time.sleep(0.01)
+            return conn
+
+        runner = self.make_runner(connect=slow_connection, steady_state_queries=["SELECT 1;"],
+                                  steady_state_interval=0.005, llm_validation=False)
+        runner.get_schema_context = lambda: "schema"
+        runner.shared_queue.put_batch([QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(40)])
+        runner.shared_queue.put(None)
+        steady_results = []
+        with patch("workload.query_runner.logger") as log:
+            steady = threading.Thread(target=lambda: steady_results.extend(runner.run_steady_state_workload()))
+            steady.start()
+            results = runner.run_concurrent_queries(timeout=10)
+            runner.stop_steady_state()
+            steady.join(timeout=5)
+        self.assertEqual(len(results), 40)
+        self.assertEqual([r for r in results + steady_results if "Error executing" in r], [])
+        planner_failures = [c for c in log.warning.call_args_list if "Could not plan" in c.args[0]]
+        self.assertEqual(planner_failures, [])
+
+    def test_close_closes_query_and_schema_pools(self):
+        runner = self.make_runner()
+        with pooled_connection(runner.connection_string):
+            pass
+        self.assertEqual(set(_POOLS), {runner.query_dsn, runner.connection_string})
+        runner.close()
+        self.assertEqual(_POOLS, {})
+
+    def test_statement_timeout_keeps_configured_options(self):
+        from psycopg2.extensions import parse_dsn
+        runner = self.make_runner(connection_string="dbname=test options='-c search_path=foo'",
+                                  statement_timeout_ms=1000)
+        self.assertEqual(parse_dsn(runner.query_dsn)["options"], "-c search_path=foo -c statement_timeout=1000")
+        runner = self.make_runner(connection_string="postgresql://localhost/test", statement_timeout_ms=1000)
+        self.assertEqual(parse_dsn(runner.query_dsn)["options"], "-c statement_timeout=1000")
+
+    def test_run_steady_state_workload_runs_cycles(self):
+        runner = self.make_stub_runner(concurrency=2, steady_state_queries=["SELECT 1;", "SELECT 2;"],
+                                       steady_state_interval=0.1)
+        results = runner.run_steady_state_workload(duration=0.35)
+        self.assertGreaterEqual(len(results), 4)
+        self.assertEqual(len(results) % 2, 0)
+        self.assertTrue(all(res == "Dummy executed: Steady-state query" for res in results))
+
+    def test_steady_state_results_can_be_discarded(self):
+        runner = self.make_runner(steady_state_queries=["SELECT 1;"], steady_state_interval=0.05)
+        with patch.object(runner, "_execute_query", return_value="executed") as execute:
+            self.assertEqual(runner.run_steady_state_workload(duration=0.2, keep_results=False), [])
+        self.assertGreaterEqual(execute.call_count, 3)
+
+    def test_stop_steady_state_wakes_immediately(self):
+        runner = self.make_stub_runner(steady_state_queries=["SELECT 1;"], steady_state_interval=60)
+        thread = threading.Thread(target=runner.run_steady_state_workload)
+        thread.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        runner.stop_steady_state()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_steady_state_queries_are_prepared_once_per_connection(self):
+        runner = self.make_runner(steady_state_queries=["SELECT 1;"])
+        cur = self.query_cursor()
+        cur.description = None
+        runner._execute_query("SELECT 1;", "Steady-state query", prepared=True)
+        runner._execute_query("SELECT 1;", "Steady-state query", prepared=True)
+        name = runner._statement_names["SELECT 1;"]
+        statements = [call.args[0] for call in cur.execute.call_args_list]
+        self.assertEqual(statements, [f"PREPARE {name} AS SELECT 1;", f"EXECUTE {name}", f"EXECUTE {name}"])
+
+    def test_prepared_reads_run_in_autocommit(self):
+        runner = self.make_runner(steady_state_queries=["SELECT 1;", "DELETE FROM t;"])
+        conn = self.connections[0]
+        cur = self.query_cursor()
+        cur.description = None
+        modes = []
+        cur.execute.side_effect = lambda statement: modes.append((statement.split()[0], conn.autocommit))
+        runner._execute_query("SELECT 1;", "Steady-state read", prepared=True)
+        runner._execute_query("DELETE FROM t;", "Steady-state write", prepared=True)
+        self.assertEqual(modes, [("PREPARE", True), ("EXECUTE", True), ("PREPARE", False), ("EXECUTE", False)])
+        self.assertFalse(conn.autocommit)
+
+    def test_schema_context_is_cached_until_version_changes(self):
+        runner = self.make_runner()
+        schema = [("public.orders", ["id", "total"])]
+        with patch.object(runner, "_current_schema_version", return_value="v1") as version, \
+                patch.object(runner, "_discover_schema", return_value=schema) as discover:
+            context = runner.get_schema_context()
+            self.assertIn("public.orders", context)
+            self.assertEqual(runner.get_schema_context(), context)
+            self.assertEqual((version.call_count, discover.call_count), (1, 1))
+            # After the TTL only the version is checked while it stays the same.
+            runner._schema_checked -= 3600
+            runner.get_schema_context()
+            self.assertEqual((version.call_count, discover.call_count), (2, 1))
+            runner._schema_checked -= 3600
+            version.return_value = "v2"
+            runner.get_schema_context()
+            self.assertEqual(discover.call_count, 2)
+
+    def test_validate_query_reuses_verdicts_until_schema_changes(self):
+        runner = self.make_runner()
+        with patch.object(runner, "get_schema_context", return_value="schema v1") as schema, \
+                patch.object(runner, "generate_response",
+                             return_value='{"approved": true, "explanation": "ok"}') as llm:
+            self.assertTrue(runner.validate_query("SELECT 1;", "Query"))
+            self.assertTrue(runner.validate_query("SELECT 1;", "Query"))
+            self.assertEqual(llm.call_count, 1)
+            runner.validate_query("SELECT 2;", "Query")
+            self.assertEqual(llm.call_count, 2)
+            schema.return_value = "schema v2"
+            runner.validate_query("SELECT 1;", "Query")
+            self.assertEqual(llm.call_count, 3)
+
+    def test_validate_queries_sends_only_unknown_queries_in_one_call(self):
+        runner = self.make_runner()
+        messages = [QueryMessage(f"SELECT {i};", f"Query {i}") for i in range(3)]
+        with patch.object(runner, "get_schema_context", return_value="schema"), \
+                patch.object(runner, "generate_response") as llm:
+            llm.return_value = '{"approved": true, "explanation": "ok"}'
+            runner.validate_queries(messages[:1])
+            llm.return_value = '[{"approved": false, "explanation": "bad"}, {"approved": true}]'
+            self.assertEqual(runner.validate_queries(messages), [True, False, True])
+            self.assertEqual(llm.call_count, 2)
+            prompt = llm.call_args.args[0][0]["content"]
+            self.assertNotIn("SELECT 0;", prompt)
+            self.assertIn("Query 2:\nSELECT 2;", prompt)
+            # A reply with the wrong number of verdicts rejects the whole batch.
+            llm.return_value = '[{"approved": true}]'
+            self.assertEqual(runner.validate_queries([QueryMessage("SELECT 3;", "a"), QueryMessage("SELECT 4;", "b")]),
+                             [False, False])
+            # So does a reply whose verdicts are not objects.
+            llm.return_value = '[true]'
+            self.assertEqual(runner.validate_queries([QueryMessage("SELECT 5;", "c")]), [False])
+
+    def test_planner_rejections_skip_the_llm(self):
+        runner = self.make_runner()
+        messages = [QueryMessage("SELECT * FROM missing;", "Bad"), QueryMessage("SELECT 1;", "Good")]
+        with patch.object(runner, "get_schema_context", return_value="schema"), \
+                patch.object(runner, "_plan_errors", return_value=['relation "missing" does not exist', None]) as plan, \
+                patch.object(runner, "generate_response", return_value='{"approved": true}') as llm:
+            self.assertEqual(runner.validate_queries(messages), [False, True])
+            self.assertNotIn("missing", llm.call_args.args[0][0]["content"])
+            runner.llm_validation = False
+            plan.return_value = [None]
+            self.assertEqual(runner.validate_queries([QueryMessage("SELECT 2;", "Planned")]), [True])
+            self.assertEqual(llm.call_count, 1)
+
+    def test_plan_errors_explain_single_statements_only(self):
+        runner = self.make_runner()
+        cur = self.query_cursor()
+
+        def execute(statement):
+            if "missing" in statement:
+                raise psycopg2.ProgrammingError('relation "missing" does not exist')
+
+        cur.execute.side_effect = execute
+        queries = ["SELECT * FROM missing;", "SELECT 1;", "CREATE TABLE t (id int)", "SELECT 1; DROP TABLE t;"]
+        errors = runner._plan_errors(queries)
+        self.assertEqual(errors, ['relation "missing" does not exist', None, None, None])
+        self.assertEqual([call.args[0] for call in cur.execute.call_args_list],
+                         ["EXPLAIN SELECT * FROM missing;", "EXPLAIN SELECT 1;"])
+        self.assertFalse(self.connections[0].autocommit)
+
+    def test_returns_rows_only(self):
+        self.assertTrue(_returns_rows_only("SELECT * FROM orders;"))
+        self.assertTrue(_returns_rows_only("-- Purpose: totals\n/* note */ select 1"))
+        self.assertFalse(_returns_rows_only("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d"))
+        self.assertFalse(_returns_rows_only("SELECT * INTO copy FROM orders"))
+        self.assertFalse(_returns_rows_only("SELECT 1; SELECT 2;"))
+        self.assertFalse(_returns_rows_only("UPDATE orders SET total = 0"))
+
+    def test_select_samples_through_server_side_cursor(self):
+        runner = self.make_runner()
+        cur = self.query_cursor()
+        cur.fetchmany.return_value = [(1,)]
+        result = runner._execute_query("SELECT 1;", "Sample")
+        self.connections[0].cursor.assert_called_once_with(name="sqlagent_sample")
+        cur.fetchmany.assert_called_once_with(5)
+        self.assertIn("Sample: [(1,)]", result)
+
+    def test_logged_sample_and_query_are_truncated(self):
+        runner = self.make_runner()
+        self.query_cursor().fetchmany.return_value = [("x" * 10000,)]
+        query = "SELECT " + "1, " * 1000 + "1"
+        result = runner._execute_query(query, "Wide")
+        self.assertLess(len(result), 500)
+        self.assertIn("Query: " + query[:200] + "...", result)
 
 if __name__ == '__main__':
     unittest.main()
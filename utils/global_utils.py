@@ -4,13 +4,22 @@ This module provides global utility functions and application management routine
 It also sets up structured logging for the entire application.
 """
 
-import re
+import atexit
+import copy
 import datetime
+import functools
 import json
 import logging
 import logging.config
+import logging.handlers
 import os
-import openai
+import queue
+import threading
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # orjson is optional; the stdlib parser reads the same bytes.
+    _json_loads = json.loads
 
 def extract_fenced_code(text: str, language: str = "sql") -> str:
     """
@@ -20,10 +29,18 @@ def extract_fenced_code(text: str, language: str = "sql") -> str:
     :param language: The language identifier for the fenced block (default is 'sql').
     :return: The extracted code as a string.
     """
-    pattern = rf"```{language}(.*?)```"
-    match = re.search(pattern, text, flags=re.DOTALL | re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
+    # Plain substring scans: the fences are literals, so no regex is needed.
+    tag = language.lower()
+    start = text.find("```")
+    while start >= 0:
+        body = start + 3
+        if text[body:body + len(tag)].lower() == tag:
+            body += len(tag)
+            end = text.find("```", body)
+            if end >= 0:
+                return text[body:end].strip()
+            break
+        start = text.find("```", body)
     return text.strip()
 
 def current_timestamp() -> str:
@@ -34,63 +51,117 @@ def current_timestamp() -> str:
     """
     return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 
+@functools.lru_cache(maxsize=4)
 def load_config(config_file: str = "config/config.json") -> dict:
     """
     Loads the configuration from a JSON file.
+    Results are cached per path, so the returned dictionary is shared and must not be modified.
 
     :param config_file: Path to the JSON configuration file.
     :return: A dictionary of configuration values.
     """
-    with open(config_file, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(config_file, "rb") as f:
+        return _json_loads(f.read())
+
+# Applied by setup_logging(); copied first, because dictConfig consumes the dict it is given.
+LOGGING_CONFIG = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "structured": {
+            "format": "%(asctime)s | %(levelname)s | %(name)s | %(processName)s | %(message)s"
+        }
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "structured",
+            "level": "DEBUG",
+        },
+        "file": {
+            # Appends, so each process adds to the log instead of truncating it, and
+            # opens the file only once something is logged. Not rotated: the parent and
+            # both children write it, and rotation is not safe across processes.
+            "class": "logging.FileHandler",
+            "formatter": "structured",
+            "filename": "logs/app.log",
+            "mode": "a",
+            "delay": True,
+            "level": "DEBUG",
+        }
+    },
+    "root": {
+        "handlers": ["console", "file"],
+        "level": "DEBUG",
+    }
+}
+
+_configured = False
+# Background thread that hands queued records to the configured handlers.
+_listener = None
 
 def setup_logging():
     """
     Sets up structured logging for the application using dictConfig.
     Logs include timestamp, log level, module name, process name, and message.
+    Only the first call in a process has any effect.
+
+    The root logger only enqueues records; a listener thread passes them to the console and
+    file handlers, so logging threads never wait on each other's handler locks. Processes
+    that exit without running atexit hooks, such as multiprocessing children, should call
+    stop_logging() before returning.
     """
-    logging_config = {
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "structured": {
-                "format": "%(asctime)s | %(levelname)s | %(name)s | %(processName)s | %(message)s"
-            }
-        },
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "structured",
-                "level": "DEBUG",
-            },
-            "file": {
-                "class": "logging.FileHandler",
-                "formatter": "structured",
-                "filename": "logs/app.log",
-                "mode": "w",
-                "level": "DEBUG",
-            }
-        },
-        "root": {
-            "handlers": ["console", "file"],
-            "level": "DEBUG",
-        }
-    }
-    logging.config.dictConfig(logging_config)
+    global _configured, _listener
+    if _configured:
+        return
+    os.makedirs(os.path.dirname(LOGGING_CONFIG["handlers"]["file"]["filename"]), exist_ok=True)
+    logging.config.dictConfig(copy.deepcopy(LOGGING_CONFIG))
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _listener.start()
+    atexit.register(stop_logging)
+    _configured = True
+
+def stop_logging():
+    """
+    Writes out all queued log records and stops the listener started by setup_logging().
+    Later records go directly to the handlers until setup_logging() is called again.
+    """
+    global _configured, _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    _configured = False
+    logging.getLogger().handlers = list(listener.handlers)
+    listener.stop()
 
 def run_generator(config: dict, shared_queue):
     """
     Runs the AI query generator process.
     """
+    # Child processes do not inherit the parent's logging configuration.
+    setup_logging()
+    import openai
     openai.api_key = os.environ.get("OPENAI_API_KEY")
     connection_str = config["db_connection"]
     goal = config.get("goal", "No goal specified")
     max_queries = config.get("max_ad_hoc_queries", 10)  # use config value, default to 10
     model_name = config.get("model_name", "gpt-3.5-turbo")  # configuration parameter used here
+    batch_size = config.get("llm_batch_size", 5)  # queries requested per LLM call
+    llm_concurrency = config.get("llm_concurrency", 4)  # LLM calls in flight at once
     # Import AIQueryGenerator here to break circular dependency
     from agent.ai_query_generator import AIQueryGenerator
-    generator = AIQueryGenerator(connection_str, shared_queue, model_name=model_name)
-    generator.generate_queries(goal=goal, num_queries=max_queries)
+    try:
+        with AIQueryGenerator(connection_str, shared_queue, model_name=model_name) as generator:
+            generator.generate_queries(
+                goal=goal, num_queries=max_queries, batch_size=batch_size, concurrency=llm_concurrency
+            )
+    finally:
+        # Sentinel: tells the runner no more queries are coming, even if generation failed.
+        shared_queue.put(None)
+        stop_logging()
 
 def run_runner(config: dict, shared_queue):
     """
@@ -99,13 +170,31 @@ def run_runner(config: dict, shared_queue):
     :param config: The configuration dictionary.
     :param shared_queue: The shared queue for query messages.
     """
+    # Child processes do not inherit the parent's logging configuration.
+    setup_logging()
     connection_str = config["db_connection"]
     concurrency = config.get("concurrency", 1)  # use configurable concurrency
     from workload.query_runner import QueryRunner
-    runner = QueryRunner(
-        connection_string=connection_str,
-        shared_queue=shared_queue,
-        concurrency=concurrency  # updated value
-    )
-    # Run the ad-hoc queries concurrently.
-    runner.run_concurrent_queries(timeout=60.0)
+    try:
+        with QueryRunner(
+            connection_string=connection_str,
+            shared_queue=shared_queue,
+            concurrency=concurrency,  # updated value
+            steady_state_queries=config.get("steady_state_queries", []),
+            steady_state_interval=config.get("steady_state_interval", 5.0),
+            llm_validation=config.get("llm_validation", True),
+        ) as runner:
+            # The steady-state workload runs in the background while ad-hoc queries are consumed.
+            # It runs until stopped and its log messages are not used, so none are kept.
+            steady_state = threading.Thread(
+                target=runner.run_steady_state_workload, kwargs={"keep_results": False}, name="steady-state"
+            )
+            steady_state.start()
+            try:
+                # Run the ad-hoc queries concurrently.
+                runner.run_concurrent_queries(timeout=60.0)
+            finally:
+                runner.stop_steady_state()
+                steady_state.join()
+    finally:
+        stop_logging()
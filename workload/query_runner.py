@@ -5,21 +5,85 @@ executes them concurrently against a Postgres database, and runs a steady-state
 """
 
 import os
+import re
+import json
 import time
+import hashlib
+import reprlib
+import weakref
 import queue
 import logging
-import psycopg2
-import openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 from queue_manager.shared_queue import SharedQueue
 from queue_manager.query_message import QueryMessage
 from utils.global_utils import current_timestamp
-from agent.base_ai_agent import BaseAIAgent
+from agent.base_ai_agent import (
+    BaseAIAgent, close_pool, connection_pool, fetch_schema_version, pooled_connection
+)
 
 logger = logging.getLogger(__name__)
 
+# Seconds the formatted schema is reused before the catalog version is checked again.
+SCHEMA_CONTEXT_TTL = 60.0
+
+# Validation verdicts remembered per runner, most recently used last.
+VALIDATION_CACHE_SIZE = 4096
+# Most queries a worker takes from the queue and validates with one LLM call.
+VALIDATION_BATCH_SIZE = 8
+# Validation batches in flight at once; they share the client's HTTP/2 connection.
+VALIDATION_CONCURRENCY = 4
+
+# Names of the steady-state statements already prepared on each pooled connection.
+_PREPARED_STATEMENTS = weakref.WeakKeyDictionary()
+
+# Server-side cursor used to read result samples; unique per connection is enough.
+_SAMPLE_CURSOR = "sqlagent_sample"
+# First keywords of statements that only return rows and can therefore be DECLAREd as a cursor.
+_ROW_ONLY_KEYWORDS = {"select", "values", "table"}
+_FIRST_KEYWORD_RE = re.compile(r"\s*(?:(?:--[^\n]*(?:\n|$)|/\*.*?\*/)\s*)*(\w+)", re.S)
+_INTO_RE = re.compile(r"\binto\b", re.I)
+# First keywords of statements EXPLAIN accepts; anything else skips the planner check.
+_EXPLAINABLE_KEYWORDS = {"select", "values", "table", "with", "insert", "update", "delete", "merge"}
+
+# Bounds the size of a logged result sample however wide its values are.
+_SAMPLE_REPR = reprlib.Repr()
+_SAMPLE_REPR.maxstring = _SAMPLE_REPR.maxother = 80
+_SAMPLE_REPR.maxtuple = 20
+# Characters of the query text kept in a log line.
+LOG_QUERY_CHARS = 200
+
+
+def _returns_rows_only(query: str) -> bool:
+    """
+    Tells whether ``query`` is a single statement that only reads rows, i.e. one that can run
+    through a server-side cursor. SELECT ... INTO and multi-statement strings are excluded;
+    the check errs on the side of a regular cursor.
+    """
+    match = _FIRST_KEYWORD_RE.match(query)
+    return (
+        match is not None
+        and match.group(1).lower() in _ROW_ONLY_KEYWORDS
+        and ";" not in query.rstrip().rstrip(";")
+        and not _INTO_RE.search(query)
+    )
+
+
+def _explainable(query: str) -> bool:
+    """
+    Tells whether ``query`` is a single statement that EXPLAIN can plan without running it.
+    """
+    match = _FIRST_KEYWORD_RE.match(query)
+    return (
+        match is not None
+        and match.group(1).lower() in _EXPLAINABLE_KEYWORDS
+        and ";" not in query.rstrip().rstrip(";")
+    )
+
+
 class QueryRunner(BaseAIAgent):
     """
     Executes queries from a shared queue concurrently.
@@ -33,6 +97,10 @@ class QueryRunner(BaseAIAgent):
         concurrency: int = 5,
         model_name: str = "gpt-3.5-turbo",
         temperature: float = 0.0,  # Validator uses low temperature for determinism
+        statement_timeout_ms: int = 30000,
+        steady_state_queries: Optional[List[str]] = None,
+        steady_state_interval: float = 5.0,
+        llm_validation: bool = True,
     ):
         # Initialize common AI functionality.
         super().__init__(model_name, temperature)
@@ -40,75 +108,262 @@ class QueryRunner(BaseAIAgent):
         self.shared_queue = shared_queue
         self.logs_dir = logs_dir
         os.makedirs(self.logs_dir, exist_ok=True)
-        logging.basicConfig(
-            filename=os.path.join(self.logs_dir, "query_runner.log"),
-            level=logging.INFO,
-            format="%(asctime)s | %(levelname)s | %(name)s | %(processName)s | %(message)s"
-        )
         self.concurrency = concurrency
+        self.steady_state_queries = steady_state_queries or []
+        self.steady_state_interval = steady_state_interval
+        # Whether queries the planner accepts are also judged by the LLM for logical sense.
+        self.llm_validation = llm_validation
+        # Steady-state queries never change, so each is prepared once per connection and then
+        # executed by name, skipping parsing and planning on every cycle.
+        self._statement_names = {
+            query: "sqlagent_steady_" + hashlib.sha1(query.encode()).hexdigest()[:16]
+            for query in self.steady_state_queries
+        }
+        self._stop_event = threading.Event()
+        # Formatted schema shared by all validating workers; see get_schema_context().
+        self._schema_lock = threading.Lock()
+        self._schema_context: Optional[str] = None
+        self._schema_version: Optional[str] = None
+        self._schema_checked = 0.0
+        # LLM verdicts keyed by a digest of schema context, query and comment, so repeated
+        # queries are not sent for validation again until the schema changes.
+        self._validation_lock = threading.Lock()
+        self._validations: "OrderedDict[str, bool]" = OrderedDict()
+        from psycopg2.extensions import make_dsn, parse_dsn
+        # Generated queries run on their own pool, whose sessions cancel any statement that
+        # exceeds the timeout, so one runaway query cannot hold a worker indefinitely.
+        # make_dsn() replaces options, so the timeout is added to any already configured.
+        options = parse_dsn(connection_string).get("options", "")
+        self.query_dsn = make_dsn(
+            connection_string, options=f"{options} -c statement_timeout={statement_timeout_ms}".strip()
+        )
+        # Keep a connection per worker open between queries, so each query skips the
+        # connect and authentication round-trips. getconn() raises instead of waiting when the
+        # pool is exhausted, so it admits every thread that may hold a connection at once: the
+        # ad-hoc and steady-state workers, and the validators' planner checks.
+        connection_pool(self.query_dsn, minconn=concurrency, maxconn=2 * concurrency + VALIDATION_CONCURRENCY)
 
-    def _execute_query(self, query_str: str, comment: str) -> str:
+    def _execute_query(self, query_str: str, comment: str, prepared: bool = False) -> str:
         """
         Executes a single SQL query and logs the result.
 
         :param query_str: The SQL query to execute.
         :param comment: A brief description of the query's purpose.
+        :param prepared: Run a steady-state query as a prepared statement, preparing it on
+                         first use of the connection.
         :return: A log message with execution details.
         """
         start = time.time()
         try:
-            with psycopg2.connect(self.connection_string) as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query_str)
-                    if cur.description:
-                        rows = cur.fetchall()
-                        sample = rows[:5]
-                        message = f"Executed Query: {comment} | Sample: {sample}"
-                    else:
-                        message = f"Executed Query: {comment} | Rows affected: {cur.rowcount}"
+            with pooled_connection(self.query_dsn) as conn:
+                read_only = _returns_rows_only(query_str)
+                if not prepared and read_only:
+                    # A server-side cursor makes Postgres send only the sample rows, not the
+                    # whole result set.
+                    with conn.cursor(name=_SAMPLE_CURSOR) as cur:
+                        cur.itersize = 5
+                        cur.execute(query_str)
+                        sample = cur.fetchmany(5)
+                    message = f"Executed Query: {comment} | Sample: {_SAMPLE_REPR.repr(sample)}"
+                else:
+                    # A plain read needs no transaction; autocommit saves the BEGIN and COMMIT
+                    # round-trips. Reset before the connection goes back to the pool.
+                    conn.autocommit = read_only
+                    try:
+                        with conn.cursor() as cur:
+                            message = self._run_on_cursor(cur, conn, query_str, comment, prepared)
+                    finally:
+                        conn.autocommit = False
         except Exception as e:
             message = f"Error executing query: {comment} - {e}"
         duration = time.time() - start
+        if len(query_str) > LOG_QUERY_CHARS:
+            query_str = query_str[:LOG_QUERY_CHARS] + "..."
         log_message = f"[RUNNER] {message} | Duration: {duration:.2f}s | Query: {query_str}"
+        # Built eagerly because it is also the return value; passed without args, so logging
+        # does not format it again.
         logger.info(log_message)
         return log_message
 
+    def _run_on_cursor(self, cur, conn, query_str: str, comment: str, prepared: bool) -> str:
+        """
+        Runs a query on a regular cursor of ``conn``; used for steady-state and writing statements.
+
+        :return: The outcome part of the log message.
+        """
+        if prepared:
+            name = self._statement_names[query_str]
+            names = _PREPARED_STATEMENTS.setdefault(conn, set())
+            if name not in names:
+                cur.execute(f"PREPARE {name} AS {query_str}")
+                names.add(name)
+            cur.execute(f"EXECUTE {name}")
+        else:
+            cur.execute(query_str)
+        if cur.description:
+            # Only the sample is converted to Python objects; the rest is discarded.
+            sample = cur.fetchmany(5)
+            return f"Executed Query: {comment} | Sample: {_SAMPLE_REPR.repr(sample)}"
+        return f"Executed Query: {comment} | Rows affected: {cur.rowcount}"
+
+    def close(self):
+        """
+        Closes the pooled query and schema connections and the OpenAI client.
+        """
+        close_pool(self.query_dsn)
+        close_pool(self.connection_string)
+        super().close()
+
     def get_schema_context(self) -> str:
         """
         Retrieves schema context using BaseAIAgent shared methods.
+        The formatted schema is cached; once it is SCHEMA_CONTEXT_TTL seconds old, the cheap
+        catalog version probe decides whether it has to be rediscovered.
+        """
+        with self._schema_lock:
+            now = time.monotonic()
+            if self._schema_context is not None and now - self._schema_checked < SCHEMA_CONTEXT_TTL:
+                return self._schema_context
+            version = self._current_schema_version()
+            if self._schema_context is None or version is None or version != self._schema_version:
+                schema = self._discover_schema(self.connection_string)
+                self._schema_context = self._format_schema_for_prompt(schema)
+                self._schema_version = version
+            self._schema_checked = now
+            return self._schema_context
+
+    def _current_schema_version(self) -> Optional[str]:
         """
-        schema_dict = self._discover_schema(self.connection_string)
-        return self._format_schema_for_prompt(schema_dict)
+        Returns the catalog version token, or None if it could not be read.
+        """
+        try:
+            with pooled_connection(self.connection_string) as conn:
+                return fetch_schema_version(conn)
+        except Exception as e:
+            logger.warning("Could not read the schema version: %s", e)
+            return None
+
+    def _plan_errors(self, queries: List[str]) -> List[Optional[str]]:
+        """
+        Asks Postgres to plan each query with EXPLAIN, which parses it and resolves its tables
+        and columns without running it. All queries are checked on one connection borrowed
+        from the query pool, which is sized for one per validator.
+
+        :param queries: The queries to check.
+        :return: One entry per query: the planner's error, or None if the query was planned or
+                 could not be checked.
+        """
+        import psycopg2
+        errors: List[Optional[str]] = [None] * len(queries)
+        try:
+            with pooled_connection(self.query_dsn) as conn:
+                # Only single statements are explained and EXPLAIN does not execute them, so
+                # no transaction is needed around the checks.
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cur:
+                        for i, query in enumerate(queries):
+                            if not _explainable(query):
+                                continue
+                            try:
+                                cur.execute("EXPLAIN " + query)
+                            except (psycopg2.ProgrammingError, psycopg2.DataError) as e:
+                                errors[i] = str(e).strip()
+                finally:
+                    conn.autocommit = False
+        except Exception as e:
+            logger.warning("Could not plan queries for validation: %s", e)
+        return errors
 
     def validate_query(self, query: str, comment: str) -> bool:
         """
-        Evaluates the SQL query for validity and logical sense using the responses API.
-        Incorporates the current database schema context.
-        Expects the AI to return a JSON object with keys:
+        Evaluates the SQL query for validity and, optionally, logical sense.
+        See validate_queries().
+        """
+        return self.validate_queries([QueryMessage(query, comment)])[0]
+
+    def validate_queries(self, messages: List[QueryMessage]) -> List[bool]:
+        """
+        Evaluates several SQL queries for validity and logical sense. Queries the Postgres
+        planner rejects are refused without asking the LLM; if ``llm_validation`` is set, the
+        rest are judged with a single call to the responses API, incorporating the current
+        database schema context. Verdicts already known for the same schema, query and comment
+        are reused and not checked again.
+        Expects the AI to return a JSON array with one object per query, in order, with keys:
             approved (boolean) and explanation (string).
+
+        :param messages: The queries to evaluate.
+        :return: One verdict per message; True if the query was approved.
         """
         schema_context = self.get_schema_context()
+        keys = [
+            hashlib.sha1("\0".join((schema_context, msg.query, msg.comment)).encode()).hexdigest()
+            for msg in messages
+        ]
+        with self._validation_lock:
+            verdicts = [self._validations.get(key) for key in keys]
+            for key, approved in zip(keys, verdicts):
+                if approved is not None:
+                    self._validations.move_to_end(key)
+        pending = [i for i, approved in enumerate(verdicts) if approved is None]
+        if not pending:
+            return verdicts
+        decided = {}
+        for i, error in zip(pending, self._plan_errors([messages[i].query for i in pending])):
+            if error is not None:
+                logger.warning("Query rejected by the planner: %s", error)
+                decided[i] = False
+        pending = [i for i in pending if i not in decided]
+        if pending and self.llm_validation:
+            decided.update(self._llm_verdicts(messages, pending, schema_context))
+        else:
+            decided.update((i, True) for i in pending)
+        with self._validation_lock:
+            for i, approved in decided.items():
+                verdicts[i] = approved
+                if approved is not None:
+                    self._validations[keys[i]] = approved
+            while len(self._validations) > VALIDATION_CACHE_SIZE:
+                self._validations.popitem(last=False)
+        # A verdict the LLM could not give counts as a rejection but is not remembered.
+        return [bool(approved) for approved in verdicts]
+
+    def _llm_verdicts(self, messages: List[QueryMessage], pending: List[int], schema_context: str) -> dict:
+        """
+        Judges ``messages[i]`` for every i in ``pending`` with a single call to the responses API.
+
+        :return: Verdict by message index; None for every index if no usable answer came back.
+        """
+        numbered = "\n\n".join(
+            f"Query {n}:\n{messages[i].query}\n\nComment {n}:\n{messages[i].comment}"
+            for n, i in enumerate(pending, 1)
+        )
         prompt = (
             f"Using the following schema context:\n{schema_context}\n\n"
-            f"Evaluate the following SQL query and return a JSON object with the following format:\n"
-            f'{{"approved": <boolean>, "explanation": "<brief explanation>"}}\n\n'
-            f"Query:\n{query}\n\nComment:\n{comment}"
+            f"Evaluate each of the following {len(pending)} SQL queries and return a JSON array "
+            f"with one object per query, in the same order, with the following format:\n"
+            f'[{{"approved": <boolean>, "explanation": "<brief explanation>"}}]\n\n'
+            f"{numbered}"
         )
         try:
             response_text = self.generate_response([{"role": "user", "content": prompt}])
-            logger.debug(f"Validation response: {response_text}")
-            import json
-            result = json.loads(response_text)
-            approved = result.get("approved", False)
-            explanation = result.get("explanation", "")
-            if approved:
-                return True
-            else:
-                logger.warning("Query validation rejected: %s", explanation)
-                return False
+            logger.debug("Validation response: %s", response_text)
+            results = json.loads(response_text)
+            if isinstance(results, dict):
+                results = [results]
+            if len(results) != len(pending):
+                raise ValueError(f"expected {len(pending)} verdicts, got {len(results)}")
+            if not all(isinstance(result, dict) for result in results):
+                raise ValueError("every verdict must be a JSON object")
         except Exception as e:
             logger.error("Error during query validation: %s", e)
-            return False
+            return dict.fromkeys(pending)
+        verdicts = {}
+        for i, result in zip(pending, results):
+            verdicts[i] = bool(result.get("approved", False))
+            if not verdicts[i]:
+                logger.warning("Query validation rejected: %s", result.get("explanation", ""))
+        return verdicts
 
     def generate_response(self, input_data: List[dict]) -> str:
         """
@@ -121,40 +376,131 @@ class QueryRunner(BaseAIAgent):
             temperature=self.temperature,
             max_output_tokens=1500  # increased from 10 to meet minimum requirement
         )
-        logger.debug(f"openai response: {response.output[0].content[0].text}")
-        return response.output[0].content[0].text.strip()
+        text = response.output[0].content[0].text
+        logger.debug("openai response: %s", text)
+        return text.strip()
 
     def run_concurrent_queries(self, timeout: float = 60.0) -> List[str]:
         """
-        Consumes QueryMessage objects from the shared queue and executes them concurrently.
+        Executes QueryMessage objects from the shared queue until the producer's None sentinel
+        arrives or the timeout expires. Each of VALIDATION_CONCURRENCY validator threads takes
+        whatever is waiting, up to VALIDATION_BATCH_SIZE messages, validates it with a single
+        LLM call and hands the approved messages to ``concurrency`` execution threads, so LLM
+        calls overlap each other and the database work instead of adding up. Queries approved
+        before the timeout still run.
 
         :param timeout: Maximum time in seconds to run concurrent queries.
         :return: A list of log messages for executed queries.
         """
-        start_time = time.time()
-        futures = []
-        results = []
+        deadline = time.monotonic() + timeout
+        results = queue.SimpleQueue()
+        approved_queue = queue.SimpleQueue()
 
-        def worker(query_msg: QueryMessage):
-            # Validate the query before executing it.
-            if not self.validate_query(query_msg.query, query_msg.comment):
-                return f"Query skipped due to failed validation: {query_msg.comment}"
-            return self._execute_query(query_msg.query, query_msg.comment)
-
-        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
-            while (time.time() - start_time) < timeout:
+        def validator():
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
                 try:
-                    query_msg = self.shared_queue.get(block=True, timeout=1)
-                    future = executor.submit(worker, query_msg)
-                    futures.append(future)
+                    # Blocks until the producer publishes, rather than waking up to poll.
+                    batch = self.shared_queue.get_batch(VALIDATION_BATCH_SIZE, timeout=remaining)
                 except queue.Empty:
-                    # Continue waiting until overall timeout is reached
-                    continue
-            for f in as_completed(futures):
-                results.append(f.result())
+                    return
+                messages = [query_msg for query_msg in batch if query_msg is not None]
+                try:
+                    verdicts = self.validate_queries(messages) if messages else []
+                except Exception:
+                    # Skip the batch but keep going, or a sentinel in it would never be passed on.
+                    logger.exception("Query validation failed")
+                    verdicts = [False] * len(messages)
+                for query_msg, approved in zip(messages, verdicts):
+                    if approved:
+                        approved_queue.put(query_msg)
+                    else:
+                        results.put(f"Query skipped due to failed validation: {query_msg.comment}")
+                if len(messages) < len(batch):
+                    # Pass the sentinel on so the other validators stop too.
+                    self.shared_queue.put(None)
+                    return
+
+        def executor():
+            # Runs until its None, even past the deadline, which already bounds the validators,
+            # so every approved message gets a result.
+            while True:
+                query_msg = approved_queue.get()
+                if query_msg is None:
+                    return
+                results.put(self._execute_query(query_msg.query, query_msg.comment))
+
+        validators = [
+            threading.Thread(target=validator, name=f"query-validator-{i}")
+            for i in range(VALIDATION_CONCURRENCY)
+        ]
+        executors = [
+            threading.Thread(target=executor, name=f"query-worker-{i}") for i in range(self.concurrency)
+        ]
+        for thread in validators + executors:
+            thread.start()
+        for thread in validators:
+            thread.join()
+        # Nothing more will be approved; let the executors finish what is queued and stop.
+        for _ in executors:
+            approved_queue.put(None)
+        for thread in executors:
+            thread.join()
         logger.info("All concurrent queries complete.")
+        return [results.get() for _ in range(results.qsize())]
+
+    def run_steady_state_workload(self, duration: Optional[float] = None, keep_results: bool = True) -> List[str]:
+        """
+        Runs every steady-state query once per ``steady_state_interval`` seconds, until
+        stop_steady_state() is called or ``duration`` seconds have passed.
+        Cycles start on a fixed schedule and their queries run concurrently, so slow
+        queries do not push back later cycles; a cycle is skipped while the previous one
+        is still running.
+
+        :param duration: Maximum time in seconds to run, or None to run until stopped.
+        :param keep_results: Collect the log messages to return; a caller that runs until stopped
+                             and ignores them should pass False, so memory does not grow per cycle.
+        :return: A list of log messages for executed queries, empty if ``keep_results`` is False.
+        """
+        if not self.steady_state_queries:
+            return []
+        next_cycle = time.monotonic()
+        end = None if duration is None else next_cycle + duration
+        results = []
+        executed = 0
+        cycle = []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="steady-state") as executor:
+            while not self._stop_event.is_set():
+                if all(f.done() for f in cycle):
+                    # Only the running cycle is referenced; finished ones are counted and dropped.
+                    executed += len(cycle)
+                    if keep_results:
+                        results.extend(f.result() for f in cycle)
+                    cycle = [
+                        executor.submit(self._execute_query, query, "Steady-state query", prepared=True)
+                        for query in self.steady_state_queries
+                    ]
+                else:
+                    logger.warning("Previous steady-state cycle still running; skipping this one.")
+                next_cycle += self.steady_state_interval
+                if end is not None and next_cycle >= end:
+                    break
+                # Wakes up at once when stop_steady_state() is called.
+                self._stop_event.wait(max(0.0, next_cycle - time.monotonic()))
+        executed += len(cycle)
+        if keep_results:
+            results.extend(f.result() for f in cycle)
+        logger.info("Steady-state workload stopped after %d queries.", executed)
         return results
 
+    def stop_steady_state(self):
+        """
+        Stops run_steady_state_workload after the queries already submitted finish.
+        """
+        self._stop_event.set()
+
 def main():
     """
     Main function for testing the QueryRunner directly.
@@ -164,6 +510,7 @@ def main():
     from queue_manager.shared_queue import SharedQueue
     shared_q = SharedQueue()
     shared_q.put(QueryMessage("SELECT * FROM public.orders LIMIT 10;", "Test ad-hoc query"))
+    shared_q.put(None)  # No more queries.
     runner = QueryRunner(
         connection_string=connection_str,
         shared_queue=shared_q,